@@ -0,0 +1,202 @@
+"""
+this file contains the asyncio ingestion engine (async neo4j driver)
+"""
+import asyncio
+import random
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from neo4j import AsyncGraphDatabase
+
+from neo4j_handler import RETRYABLE_ERRORS, edge_properties, node_type_labels, relationship_index_statements
+from metrics import timer
+from queries import QueryCatalog
+from settings import ENV
+
+
+class AsyncIngestor:
+    """async ingestion engine
+
+    records are parsed in a worker thread and collected into batches, the
+    new nodes of a batch are merged (one transaction, before any edge of
+    the batch is queued) and its edges are written by a fixed number of
+    concurrent write transactions which only MATCH existing nodes, so no
+    two transactions merge the same node; the bounded batch queue makes
+    the reader wait whenever the writers fall behind
+    """
+
+    def __init__(self, config: Dict, metrics=None) -> None:
+        """ initialize async neo4j driver with given config"""
+        self.driver = AsyncGraphDatabase.driver(
+            config["uri"],
+            auth=(
+                config["userName"],
+                config["password"]
+            )
+        )
+        self.batch_size = int(config.get("batch_size", ENV.Neo4j_BATCH_SIZE))
+        self.concurrency = int(config.get("concurrency", ENV.Neo4j_CONCURRENCY))
+        self.queue_size = int(config.get("queue_size", ENV.Neo4j_QUEUE_SIZE))
+        self.max_retries = int(config.get("max_retries", ENV.Neo4j_MAX_RETRIES))
+        self.retry_backoff = float(config.get("retry_backoff", ENV.Neo4j_RETRY_BACKOFF))
+        self.batch_count = 0            # number of batches sent so far
+        self.failed_batches = []        # reports of batches which could not be written
+        self.nodes = set()              # names of the nodes written so far
+        self.run_id = config.get("run_id")      # tag of the nodes/edges of this ingestion run (None = untagged)
+        self.metrics = metrics                  # pipeline metrics (None = not measured)
+        self.queries = QueryCatalog(run_scoped=self.run_id is not None)
+        self.relationship_indexes = set(config.get("relationship_indexes", ENV.Neo4j_RELATIONSHIP_INDEXES))
+        self.indexed_labels = set()             # edge labels whose property indexes exist
+
+    async def ingest(self, records: Iterable[Tuple[str, str, Dict]]) -> List[Dict]:
+        """write (node_1, node_2, edge) records
+
+        :param records: iterable of (node_1, node_2, edge), e.g. GraphHandler.records_txt
+        :return: reports of the failed batches
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        writers = [asyncio.create_task(self.writer(queue)) for _ in range(self.concurrency)]
+        loop = asyncio.get_running_loop()
+        batches = self.batches(records)
+
+        while True:
+            batch = await loop.run_in_executor(None, next, batches, None)      # parse while the writers write
+            if batch is None:
+                break
+            await self.ensure_relationship_indexes(batch)
+            if not await self.write_nodes(batch):
+                self.failed_batches.append(
+                    {"batch": self.batch_count, "kind": "edges", "size": len(batch), "error": "nodes not written"}
+                )
+                continue
+            await queue.put(batch)          # waits here while the queue is full (backpressure)
+        for _ in writers:
+            await queue.put(None)           # stop signal, one per writer
+        await asyncio.gather(*writers)
+
+        failed_batches, self.failed_batches = self.failed_batches, []
+        return failed_batches
+
+    def batches(self, records: Iterable[Tuple[str, str, Dict]]) -> Iterator[List[Tuple[str, str, Dict]]]:
+        """ lists of batch_size records """
+        records = iter(records)
+        while True:
+            batch = list(islice(records, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    async def ensure_relationship_indexes(self, batch: List[Tuple[str, str, Dict]]) -> None:
+        """ index the relationship_indexes properties of the edge labels of (batch) not indexed yet """
+        statements = relationship_index_statements(
+            self.queries, {edge["label"] for _node_1, _node_2, edge in batch},
+            self.indexed_labels, self.relationship_indexes,
+        )
+        if not statements:
+            return
+        async with self.driver.session() as session:
+            for statement in statements:
+                result = await session.run(statement)
+                await result.consume()
+
+    async def write_nodes(self, batch: List[Tuple[str, str, Dict]]) -> bool:
+        """merge the nodes of (batch) not written yet, with their typed labels
+
+        :return: True if all nodes of (batch) are written
+        """
+        names = {node for node_1, node_2, _edge in batch for node in (node_1, node_2)} - self.nodes
+        if not names:
+            return True
+        node_labels = {}
+        for node in sorted(names):
+            node_labels.setdefault(node_type_labels(node), []).append(node)
+
+        async def write(tx):
+            for typed_labels, rows in node_labels.items():
+                result = await tx.run(self.queries.merge_nodes(typed_labels), rows=rows, run_id=self.run_id)
+                await result.consume()
+
+        if not await self.write_transaction("nodes", len(names), write):
+            return False
+        self.nodes |= names
+        if self.metrics is not None:
+            self.metrics.count("nodes_created", len(names))
+        return True
+
+    async def writer(self, queue: asyncio.Queue) -> None:
+        """ write batches from the queue until the stop signal """
+        while True:
+            batch = await queue.get()
+            if batch is None:
+                return
+            await self.write_batch(batch)
+
+    async def write_batch(self, batch: List[Tuple[str, str, Dict]]) -> None:
+        """ create the edges of one batch in one transaction, their nodes are already written """
+        labels = {}
+        for node_1, node_2, edge in batch:
+            labels.setdefault(edge["label"], []).append(
+                {"source": node_1, "target": node_2, "properties": edge_properties(edge)}
+            )
+
+        async def write(tx):
+            for label, rows in labels.items():
+                result = await tx.run(self.queries.create_edges(label), rows=rows, run_id=self.run_id)
+                await result.consume()
+
+        if await self.write_transaction("edges", len(batch), write) and self.metrics is not None:
+            self.metrics.count("edges_created", len(batch))
+
+    async def write_transaction(self, kind: str, size: int, write) -> bool:
+        """run (write) in one explicit transaction, retry transient errors with backoff
+
+        this is the only retry layer (execute_write would retry on its own),
+        a batch which still fails is recorded in failed_batches
+        :return: True if the transaction is committed
+        """
+        self.batch_count += 1
+        batch_number = self.batch_count
+        for attempt in range(self.max_retries + 1):
+            try:
+                with timer(self.metrics, "neo4j_wait"):
+                    async with self.driver.session() as session:
+                        tx = await session.begin_transaction()
+                        try:
+                            await write(tx)
+                            await tx.commit()
+                        finally:
+                            await tx.close()
+                return True
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    error = e
+                    break
+                delay = self.retry_backoff * 2 ** attempt
+                await asyncio.sleep(delay + random.uniform(0, delay))     # exponential backoff with jitter
+            except Exception as e:
+                error = e
+                break
+
+        self.failed_batches.append(
+            {"batch": batch_number, "kind": kind, "size": size, "error": f"{error}"}
+        )
+        return False
+
+    async def close(self) -> None:
+        """ close the async driver """
+        await self.driver.close()
+
+
+async def ingest_records(config: Dict, records: Iterable[Tuple[str, str, Dict]], metrics=None) -> List[Dict]:
+    """write records with a new AsyncIngestor and close it afterwards
+
+    :return: reports of the failed batches
+    """
+    ingestor = AsyncIngestor(config, metrics)
+    try:
+        failed_batches = await ingestor.ingest(records)
+    finally:
+        await ingestor.close()
+    for report in failed_batches:
+        print(f"batch {report['batch']} ({report['size']} {report['kind']}) failed: {report['error']}")
+    return failed_batches
@@ -0,0 +1,141 @@
+"""
+    this file contains throughput measurements of the log processing stages
+"""
+import argparse
+import sys
+import tempfile
+from itertools import islice
+from multiprocessing import get_context
+from os import path as os_path
+from resource import RUSAGE_SELF, getrusage
+from time import perf_counter
+
+from graph_handler import GraphHandler
+from graph_sink import MemoryGraphSink
+from input_reader import open_input, read_txt_lines
+from log_filter import LogFilter
+from log_generator import SwiftLogGenerator, parse_mix
+from settings import ENV
+
+DEFAULT_SIZES = "10k,100k,1M"           # input sizes of the benchmark suite (up to 10M)
+STAGES = ("read", "parse", "extract", "write")
+
+
+class NullLogger:
+    """ logger stand-in, unprocessible lines are only counted """
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def error(self, *args, **kwargs):
+        self.count += 1
+
+    def reject(self, line, reason):
+        self.count += 1
+
+
+def parse_throughput(parser, lines, repeat=3):
+    """
+    measure LogFilter.parse_log throughput, best of (repeat) runs
+
+    :return: parsed lines per second
+    """
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        for line in lines:
+            parser.parse_log(line)
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(lines) / best if best else float("inf")
+
+
+def run_stage(stage, log_file_name):
+    """
+    run one stage over the whole file (in a fresh process)
+
+    each stage includes the ones before it: read -> parse -> extract
+    (GraphHandler.extract_node_edge_from_log) -> write (to a MemoryGraphSink)
+    :return: (lines, seconds, peak memory in MB)
+    """
+    parser = LogFilter()
+    graph_handler = GraphHandler(MemoryGraphSink(keep_properties=False), parser, NullLogger())
+    lines = 0
+    start = perf_counter()
+    with open(log_file_name) as f:
+        if stage == "write":
+            for line in read_txt_lines(f):
+                lines += 1
+                result = graph_handler.extract_node_edge_from_log(line)
+                if graph_handler.is_processible(line, result):
+                    graph_handler.write_node_edge(*result)
+            graph_handler.flush()
+        else:
+            for line in read_txt_lines(f):
+                lines += 1
+                if stage == "parse":
+                    parser.parse_log(line)
+                elif stage == "extract":
+                    graph_handler.extract_node_edge_from_log(line)
+    elapsed = perf_counter() - start
+    return lines, elapsed, getrusage(RUSAGE_SELF).ru_maxrss / 1024
+
+
+def parse_size(text):
+    """ '10k' -> 10000, '1M' -> 1000000 """
+    multipliers = {"k": 1000, "M": 1000000}
+    if text[-1] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text)
+
+
+def run_suite(sizes, seed, mix, hosts):
+    """ generate logs of each size and report lines/s and peak memory of every stage """
+    context = get_context("spawn")                              # fresh process per stage, clean peak memory
+    with tempfile.TemporaryDirectory() as temp_dir:
+        print(f"{'lines':>10} {'stage':>8} {'lines/s':>12} {'seconds':>9} {'peak MB':>8}")
+        for size in sizes:
+            log_file_name = os_path.join(temp_dir, f"swift_{size}.txt")
+            with open(log_file_name, "w") as f:                # streamed to disk, not kept in memory
+                for line in SwiftLogGenerator(seed, mix, hosts).lines(size):
+                    f.write(line + "\n")
+            for stage in STAGES:
+                with context.Pool(1) as pool:
+                    lines, elapsed, peak_memory = pool.apply(run_stage, (stage, log_file_name))
+                print(f"{size:>10} {stage:>8} {lines / elapsed:>12,.0f} {elapsed:>9.2f} {peak_memory:>8.1f}")
+
+
+def main(log_file_name, max_lines, min_rate):
+    """ report parse throughput, fail if it is below the guard value """
+    if log_file_name is None:                                   # no sample file, use synthetic lines
+        lines = list(SwiftLogGenerator().lines(max_lines))
+    else:
+        with open_input(log_file_name) as f:
+            lines = list(islice(read_txt_lines(f), max_lines))
+    rate = parse_throughput(LogFilter(), lines)
+    print(f"parse: {len(lines)} lines, {rate:,.0f} lines/s")
+    if min_rate and rate < min_rate:
+        print(f"parse throughput below the guard value ({min_rate:,} lines/s)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="measure log processing throughput")
+    arg_parser.add_argument("log_file_name", nargs="?", help="sample .txt log file (synthetic lines if not given)")
+    arg_parser.add_argument("--lines", type=int, default=100000, help="number of lines to measure")
+    arg_parser.add_argument(
+        "--min-rate", type=int, default=ENV.Parse_MIN_LINES_PER_SEC,
+        help="minimum accepted lines per second (exit code 1 below it)",
+    )
+    arg_parser.add_argument("--suite", action="store_true",
+                            help="run every stage (read, parse, extract, write) on synthetic logs")
+    arg_parser.add_argument("--sizes", default=DEFAULT_SIZES, help="input sizes of the suite, e.g. 10k,1M,10M")
+    arg_parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic logs")
+    arg_parser.add_argument("--mix", type=parse_mix, default=None, help="line kinds and weights of the synthetic logs")
+    arg_parser.add_argument("--hosts", type=int, default=8, help="number of storage nodes in the synthetic logs")
+    args = arg_parser.parse_args()
+    if args.suite:
+        run_suite([parse_size(size) for size in args.sizes.split(",")], args.seed, args.mix, args.hosts)
+    else:
+        main(args.log_file_name, args.lines, args.min_rate)
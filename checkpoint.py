@@ -0,0 +1,102 @@
+"""
+    this file contains the checkpoints of incrementally ingested log files
+"""
+import json
+from os import fstat as os_fstat
+from os import path as os_path
+from os import replace as os_replace
+from os import stat as os_stat
+from time import sleep
+
+from input_reader import parse_json_line, read_line_chunks
+from settings import ENV
+
+
+class Checkpoint:
+    """
+    byte offsets up to which input files are already written to the graph,
+    stored with the file identity (device, inode) to detect rotated files
+    """
+
+    def __init__(self, checkpoint_file=ENV.Checkpoint_FILE) -> None:
+        self.checkpoint_file = checkpoint_file
+        self.entries = {}           # absolute file path -> {"device", "inode", "offset"}
+        if os_path.exists(checkpoint_file):
+            with open(checkpoint_file) as f:
+                self.entries = json.load(f)
+
+    def resume_offset(self, file_name, stat=None) -> int:
+        """
+        get the offset to continue reading (file_name) from,
+        0 if the file is new, rotated or truncated
+
+        :param stat: os.fstat of the opened file (default: os.stat of file_name)
+        """
+        entry = self.entries.get(os_path.abspath(file_name))
+        if entry is None:
+            return 0
+        if stat is None:
+            stat = os_stat(file_name)
+        if (stat.st_dev, stat.st_ino) != (entry["device"], entry["inode"]):
+            return 0                                            # another file with the same name (rotated)
+        if stat.st_size < entry["offset"]:
+            return 0                                            # file is truncated
+        return entry["offset"]
+
+    def save(self, file_name, offset, stat) -> None:
+        """
+        persist the offset of (file_name), the checkpoint file is replaced atomically
+
+        :param stat: os.fstat of the file the offset was read from, the
+                     name may already point to a rotated file
+        """
+        self.entries[os_path.abspath(file_name)] = {
+            "device": stat.st_dev,
+            "inode": stat.st_ino,
+            "offset": offset,
+        }
+        temp_file = f"{self.checkpoint_file}.tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.entries, f)
+        os_replace(temp_file, self.checkpoint_file)
+
+
+def ingest_incremental(graph_handler, log_file_name, file_format, checkpoint, follow=False):
+    """
+    append new lines of (log_file_name) to the graph, starting from its checkpoint
+
+    the checkpoint is saved after each chunk whose batches are all written;
+    with follow=True the file is watched for new lines (and rotation)
+    until interrupted
+    :return: reports of the failed batches of the chunk the ingestion stopped at ([] if all lines are written)
+    """
+    graph_handler.load_existing_nodes()                             # nodes of previous runs are not created again
+    offset = None
+    while True:
+        with open(log_file_name, "rb") as f:
+            stat = os_fstat(f.fileno())                             # identity of the file the lines are read from
+            if offset is None:
+                offset = checkpoint.resume_offset(log_file_name, stat)
+            for lines, end_offset in read_line_chunks(f, offset, ENV.Neo4j_BATCH_SIZE):
+                if graph_handler.metrics is not None:
+                    lines = graph_handler.metrics.track_lines(lines)
+                if file_format == "txt":
+                    failed_batches = graph_handler.create_graph_txt(lines, clear=False)
+                if file_format == "json":                           # NDJSON, one record per line
+                    records = (parse_json_line(line) for line in lines if line.strip())
+                    failed_batches = graph_handler.create_graph_json(records, clear=False)
+                if failed_batches:
+                    print(f"stopped at offset {offset}, the failed lines are read again on the next run")
+                    return failed_batches
+                offset = end_offset
+                checkpoint.save(log_file_name, offset, stat)         # only committed lines are checkpointed
+        if not follow:
+            return []
+
+        sleep(ENV.Follow_POLL_INTERVAL)
+        try:
+            current = os_stat(log_file_name)
+        except FileNotFoundError:
+            continue                                                # rotated, new file not created yet
+        if current.st_ino != stat.st_ino or current.st_size < offset:   # rotated or truncated, start over
+            offset = 0
@@ -0,0 +1,197 @@
+"""
+    shared test helpers: a null logger and a recording stand-in of the neo4j driver
+"""
+import asyncio
+
+import pytest
+
+
+class NullLogger:
+    """ logger stand-in, rejected lines are kept for the checks """
+
+    def __init__(self) -> None:
+        self.rejected = []                  # (line, reason)
+
+    def error(self, *args, **kwargs):
+        self.rejected.append((args, None))
+
+    def reject(self, line, reason):
+        self.rejected.append((line, reason))
+
+    def stop(self):
+        pass
+
+
+class FakeResult:
+    """ result without records """
+
+    def consume(self):
+        return None
+
+    def __iter__(self):
+        return iter(())
+
+
+class FakeTransaction:
+    """ records the queries of one transaction, they reach the driver log on commit """
+
+    def __init__(self, driver) -> None:
+        self.driver = driver
+        self.queries = []
+
+    def run(self, query, **parameters):
+        self.driver.check(query, parameters)
+        self.queries.append((query, parameters))
+        return FakeResult()
+
+    def commit(self):
+        self.driver.queries.extend(self.queries)
+
+    def rollback(self):
+        self.queries = []
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, *args):
+        if error_type is None:
+            self.commit()
+
+
+class FakeSession:
+
+    def __init__(self, driver) -> None:
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def run(self, query, **parameters):
+        self.driver.check(query, parameters)
+        self.driver.queries.append((query, parameters))
+        return FakeResult()
+
+    def begin_transaction(self):
+        return FakeTransaction(self.driver)
+
+    def execute_write(self, write, *args, **kwargs):
+        self.driver.write_calls += 1
+        tx = FakeTransaction(self.driver)
+        result = write(tx, *args, **kwargs)
+        tx.commit()
+        return result
+
+
+class FakeDriver:
+    """
+    neo4j driver stand-in, committed queries are kept in (queries); a
+    query containing a key of (failures) raises the mapped exception
+    (a list of exceptions is raised one after the other, then it succeeds)
+    """
+
+    def __init__(self) -> None:
+        self.queries = []                   # (query, parameters) of the committed queries
+        self.failures = {}                  # query text part -> exception or [exceptions]
+        self.write_calls = 0                # execute_write calls (including the failed ones)
+
+    def check(self, query, parameters):
+        for part, error in self.failures.items():
+            if part not in query:
+                continue
+            if isinstance(error, list):
+                if error:
+                    raise error.pop(0)
+            else:
+                raise error
+
+    def session(self, **kwargs):
+        return FakeSession(self)
+
+    def close(self):
+        pass
+
+    def matching(self, part):
+        """ committed (query, parameters) whose query text contains (part) """
+        return [(query, parameters) for query, parameters in self.queries if part in query]
+
+
+class FakeAsyncResult:
+
+    async def consume(self):
+        return None
+
+
+class FakeAsyncTransaction(FakeTransaction):
+
+    async def run(self, query, **parameters):
+        await asyncio.sleep(0)                  # let the other transactions run
+        FakeTransaction.run(self, query, **parameters)
+        return FakeAsyncResult()
+
+    async def commit(self):
+        FakeTransaction.commit(self)
+
+    async def close(self):
+        pass
+
+
+class FakeAsyncSession:
+
+    def __init__(self, driver) -> None:
+        self.driver = driver
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def run(self, query, **parameters):
+        FakeSession(self.driver).run(query, **parameters)
+        return FakeAsyncResult()
+
+    async def begin_transaction(self):
+        return FakeAsyncTransaction(self.driver)
+
+
+class FakeAsyncDriver(FakeDriver):
+    """ async neo4j driver stand-in, see FakeDriver """
+
+    def session(self, **kwargs):
+        return FakeAsyncSession(self)
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def null_logger():
+    return NullLogger()
+
+
+@pytest.fixture
+def fake_driver(monkeypatch):
+    """ FakeDriver returned by every neo4j GraphDatabase.driver call """
+    driver = FakeDriver()
+    monkeypatch.setattr("neo4j.GraphDatabase.driver", lambda *args, **kwargs: driver)
+    return driver
+
+
+@pytest.fixture
+def fake_async_driver(monkeypatch):
+    """ FakeAsyncDriver returned by every neo4j AsyncGraphDatabase.driver call """
+    driver = FakeAsyncDriver()
+    monkeypatch.setattr("neo4j.AsyncGraphDatabase.driver", lambda *args, **kwargs: driver)
+    return driver
+
+
+@pytest.fixture
+def neo4j_config():
+    return {"uri": "bolt://localhost:7687", "userName": "neo4j", "password": "test", "batch_size": 10,
+            "ensure_schema": False}
@@ -0,0 +1,175 @@
+"""
+this file contains the CSV export sink for neo4j-admin bulk imports
+"""
+import csv
+from os import makedirs as os_makedirs
+from os import path as os_path
+from os import replace as os_replace
+from re import compile as regex_compile
+from typing import Callable, Dict, Iterable, List, Optional
+
+from graph_sink import GraphSink
+from neo4j_handler import edge_properties, node_type_labels
+from queries import UNTAGGED_RUN_ID
+from transactions import merge_summaries
+
+UNSAFE_FILE_NAME_CHARACTERS = regex_compile(r"[^A-Za-z0-9_]")
+CSV_TYPES = {int: "long", float: "double"}      # header types of non string properties
+TRANSACTION_HEADER = (                          # header of transactions.csv (summary key:type)
+    "transaction_id:ID(Transaction)", "hop_sources:string[]", "hop_destinations:string[]",
+    "hop_labels:string[]", "hop_times:double[]", "hop_request_times:double[]", "hop_status:string[]",
+    "hop_count:long", "start:double", "end:double", "latency:double", "run_id",
+)
+
+
+class RelationshipFile:
+    """
+    relationships of one label: a data file and a header file written on
+    close, the header is the union of the properties of all rows (empty
+    cells for the properties a row does not have)
+    """
+
+    __slots__ = ("file_name", "header_file_name", "f", "writer", "columns", "header", "rows", "short_rows")
+
+    def __init__(self, file_name: str) -> None:
+        self.file_name = file_name
+        self.header_file_name = file_name.replace(".csv", "_header.csv")
+        self.f = open(file_name, "w", newline="")
+        self.writer = csv.writer(self.f)
+        self.columns = {}                       # property -> position after :START_ID, :END_ID, :TYPE
+        self.header = []                        # property headers (key:type)
+        self.rows = 0
+        self.short_rows = False                 # rows were written before the last column was added
+
+    def write(self, node_1: str, node_2: str, label: str, properties: Dict) -> None:
+        columns = self.columns
+        for key, value in properties.items():
+            if key not in columns:
+                columns[key] = len(self.header)
+                self.header.append(f"{key}:{CSV_TYPES[type(value)]}" if type(value) in CSV_TYPES else key)
+                self.short_rows = self.short_rows or self.rows > 0
+        row = [""] * len(self.header)
+        for key, value in properties.items():
+            row[columns[key]] = value
+        self.writer.writerow([node_1, node_2, label, *row])
+        self.rows += 1
+
+    def close(self) -> str:
+        """write the header file, pad the rows written before the last property showed up
+
+        :return: --relationships argument of neo4j-admin (header file, data file)
+        """
+        self.f.close()
+        if self.short_rows:
+            width = 3 + len(self.header)
+            temp_file = f"{self.file_name}.tmp"
+            with open(self.file_name, newline="") as rows, open(temp_file, "w", newline="") as padded:
+                writer = csv.writer(padded)
+                for row in csv.reader(rows):
+                    writer.writerow(row + [""] * (width - len(row)))
+            os_replace(temp_file, self.file_name)
+        with open(self.header_file_name, "w", newline="") as f:
+            csv.writer(f).writerow([":START_ID", ":END_ID", ":TYPE", *self.header])
+        return f"--relationships={self.header_file_name},{self.file_name}"
+
+
+class CsvExportSink(GraphSink):
+    """csv export sink
+
+    writes nodes and relationships in the `neo4j-admin database import`
+    header format; relationships with the same label share a file (one
+    open file per label, whatever properties the edges have)
+    """
+
+    def __init__(self, output_dir: str) -> None:
+        self.output_dir = output_dir
+        if not os_path.exists(output_dir):
+            os_makedirs(output_dir)
+        self.nodes = set()                      # exported node names (deduplication)
+        self.node_file = open(os_path.join(output_dir, "nodes.csv"), "w", newline="")
+        self.node_writer = csv.writer(self.node_file)
+        self.node_writer.writerow(["name:ID", "run_id", ":LABEL"])        # node key (name, run_id) of untagged runs
+        self.relationship_files = {}            # label -> RelationshipFile
+        self.edges = 0
+        self.transactions = {}                  # transaction id -> summary, written on close
+
+    def create_new_node(self, node: str) -> None:
+        """ write node named (node) once """
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        self.node_writer.writerow([node, UNTAGGED_RUN_ID, "node" + node_type_labels(node).replace(":", ";")])
+
+    merge_new_node = create_new_node
+
+    def create_new_edge(self, node_1: str, node_2: str, edge: Dict) -> None:
+        """ write edge from node_1 to node_2, the relationship type is the edge label """
+        self.relationship_file(edge["label"]).write(node_1, node_2, edge["label"], edge_properties(edge))
+        self.edges += 1
+
+    def relationship_file(self, label: str) -> RelationshipFile:
+        """ get (or create) the relationship file of (label) """
+        relationship_file = self.relationship_files.get(label)
+        if relationship_file is None:
+            safe_label = UNSAFE_FILE_NAME_CHARACTERS.sub("_", label)
+            file_name = os_path.join(
+                self.output_dir, f"relationships_{safe_label}_{len(self.relationship_files)}.csv"
+            )
+            relationship_file = self.relationship_files[label] = RelationshipFile(file_name)
+        return relationship_file
+
+    def write_transactions(self, transactions: Iterable[Dict]) -> None:
+        """ collect transaction summaries, they are exported as :Transaction nodes on close """
+        for summary in transactions:
+            old = self.transactions.get(summary["transaction_id"])
+            self.transactions[summary["transaction_id"]] = summary if old is None else merge_summaries(old, summary)
+
+    def write_transaction_file(self) -> str:
+        """ write the collected transactions, one :Transaction node per row
+
+        :return: file name
+        """
+        file_name = os_path.join(self.output_dir, "transactions.csv")
+        with open(file_name, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow([*TRANSACTION_HEADER, ":LABEL"])
+            for summary in self.transactions.values():
+                row = []
+                for column in TRANSACTION_HEADER:
+                    key = column.split(":")[0]
+                    value = UNTAGGED_RUN_ID if key == "run_id" else summary[key]
+                    if isinstance(value, list):
+                        value = ";".join(str(item) for item in value)      # neo4j-admin array delimiter
+                    row.append("" if value is None else value)
+                writer.writerow([*row, "Transaction"])
+        return file_name
+
+    def get_node_names(self) -> set:
+        return set(self.nodes)
+
+    def clear_graph(self, progress: Optional[Callable] = None) -> int:
+        """ nothing to clear, every export starts with new files """
+        return 0
+
+    def close(self) -> str:
+        """close all files
+
+        :return: neo4j-admin command importing the exported files
+        """
+        self.node_file.close()
+        relationships = " ".join(
+            relationship_file.close() for relationship_file in self.relationship_files.values()
+        )
+        transactions = ""
+        if self.transactions:
+            transactions = f" --nodes={self.write_transaction_file()}"
+        return (
+            "neo4j-admin database import full "
+            + f"--nodes={os_path.join(self.output_dir, 'nodes.csv')}{transactions} {relationships}"
+        )
+
+    def flush(self) -> List[Dict]:
+        self.node_file.flush()
+        for relationship_file in self.relationship_files.values():
+            relationship_file.f.flush()
+        return []
@@ -0,0 +1,109 @@
+"""
+    this file contains the duplicate line filter (overlapping and rotated log files)
+"""
+from hashlib import blake2b
+from math import ceil, log
+
+from edge_aggregator import edge_timestamp
+from settings import ENV
+
+TIME_FIELDS = ("start_time", "datetime", "date_time", "timestamp")      # raw time of a line, first found
+
+
+class BloomFilter:
+    """
+    fixed size set of fingerprints without false negatives
+
+    the bit array is sized for (capacity) fingerprints at the false
+    positive rate (fp_rate), the bit positions are derived from one
+    blake2b digest (double hashing)
+    """
+
+    __slots__ = ("size", "hashes", "bits", "count")
+
+    def __init__(self, capacity, fp_rate) -> None:
+        self.size = max(8, ceil(-capacity * log(fp_rate) / log(2) ** 2))     # bits
+        self.hashes = max(1, round(self.size / capacity * log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0                      # fingerprints added
+
+    def positions(self, fingerprint: bytes):
+        digest = blake2b(fingerprint, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def contains(self, positions) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def add(self, positions) -> None:
+        bits = self.bits
+        for p in positions:
+            bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+
+
+def fingerprint(node_1, node_2, edge) -> bytes:
+    """
+    stable identity of a log line: transaction id, time, host (destination
+    node), method, source node and label; lines without transaction id
+    are identified by all their fields
+    """
+    transaction_id = edge.get("transaction_id")
+    if not transaction_id or transaction_id == "-":
+        return "\x1f".join(f"{key}={value}" for key, value in edge.items()).encode()
+    timestamp = next((edge.get(key) for key in TIME_FIELDS if edge.get(key) is not None), "-")
+    return "\x1f".join((
+        f"{transaction_id}", f"{timestamp}", node_2, f"{edge.get('method', '-')}", node_1, f"{edge.get('label', '-')}",
+    )).encode()
+
+
+class Deduplicator:
+    """
+    drops lines already seen within the time window
+
+    two generations of bloom filters are kept, a line is a duplicate if
+    either generation contains it and it is added to the current one; the
+    current generation is retired when it covers (window) seconds of log
+    time or holds (capacity) lines, so the memory stays fixed (two filters)
+    while duplicates are found for at least (window) seconds or (capacity)
+    lines, however long the input is
+    """
+
+    def __init__(self, capacity=ENV.Dedup_CAPACITY, fp_rate=ENV.Dedup_FP_RATE, window=ENV.Dedup_WINDOW) -> None:
+        self.capacity = capacity            # lines per generation
+        self.fp_rate = fp_rate              # false positive rate of a full generation
+        self.window = window                # seconds of log time per generation (0 = no expiry by time)
+        self.current = BloomFilter(capacity, fp_rate)
+        self.previous = None
+        self.generation_start = None        # log time of the first line of the current generation
+        self.duplicates = 0
+        self.rotations = 0
+
+    def rotate(self) -> None:
+        """ start a new generation, the previous one is forgotten """
+        self.previous = self.current
+        self.current = BloomFilter(self.capacity, self.fp_rate)
+        self.generation_start = None
+        self.rotations += 1
+
+    def is_duplicate(self, node_1, node_2, edge) -> bool:
+        """ check the line (edge) and remember it """
+        if self.window:
+            timestamp = edge_timestamp(edge)
+            if timestamp is not None:
+                if self.generation_start is None:
+                    self.generation_start = timestamp
+                elif timestamp - self.generation_start >= self.window:
+                    self.rotate()
+                    self.generation_start = timestamp
+        if self.current.count >= self.capacity:
+            self.rotate()
+
+        positions = self.current.positions(fingerprint(node_1, node_2, edge))
+        if self.current.contains(positions) or (self.previous is not None and self.previous.contains(positions)):
+            self.duplicates += 1
+            return True
+        self.current.add(positions)
+        return False
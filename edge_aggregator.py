@@ -0,0 +1,173 @@
+"""
+    this file contains the aggregation of repeated edges into weighted edges
+"""
+from datetime import datetime, timezone
+from functools import lru_cache
+
+
+DATETIME_FORMATS = (                    # datetime formats of the different swift log lines
+    "%d/%b/%Y:%H:%M:%S %z",             # object/container/account servers
+    "%d/%b/%Y/%H/%M/%S",                # proxy access log
+    "%d/%b/%Y %H:%M:%S",                # proxy STDERR
+    "%Y-%m-%d %H:%M:%S.%f",             # json logs (date_time)
+    "%Y-%m-%d %H:%M:%S",
+)
+
+
+@lru_cache(maxsize=65536)
+def parse_datetime(value):
+    """
+    convert a log datetime string to a unix timestamp, None if the format is unknown
+    """
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        parsed = None
+    for datetime_format in DATETIME_FORMATS:
+        if parsed is not None:
+            break
+        try:
+            parsed = datetime.strptime(value, datetime_format)
+        except ValueError:
+            continue
+    if parsed is None:
+        return None
+    if parsed.tzinfo is None:                                   # log times without zone are UTC
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def to_number(value):
+    """ convert a log field to float, None for missing values ('-') """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def edge_timestamp(edge):
+    """
+    get the unix timestamp of an edge (request start time or log datetime)
+    """
+    timestamp = to_number(edge.get("start_time"))
+    if timestamp is not None:
+        return timestamp
+    for key in ("datetime", "date_time", "timestamp"):                  # 'timestamp' is @timestamp of json records
+        value = edge.get(key)
+        if isinstance(value, str):
+            timestamp = parse_datetime(value)
+            if timestamp is not None:
+                return timestamp
+    return None
+
+
+def format_timestamp(timestamp):
+    """ unix timestamp to ISO 8601 (UTC) """
+    if timestamp is None:
+        return "-"
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class WeightedEdge(dict):
+    """
+    properties of an aggregated edge, its numbers are stored as numbers
+    """
+
+
+class EdgeGroup:
+    """
+    statistics of all edges with the same (source node, destination node, label)
+    """
+
+    __slots__ = (
+        "type", "count", "bytes_sent", "bytes_recvd", "request_time_count",
+        "request_time_sum", "request_time_min", "request_time_max",
+        "status_codes", "first_seen", "last_seen",
+    )
+
+    def __init__(self, edge_type) -> None:
+        self.type = edge_type
+        self.count = 0
+        self.bytes_sent = 0.0
+        self.bytes_recvd = 0.0
+        self.request_time_count = 0
+        self.request_time_sum = 0.0
+        self.request_time_min = None
+        self.request_time_max = None
+        self.status_codes = {}
+        self.first_seen = None
+        self.last_seen = None
+
+    def add(self, edge):
+        """ add one edge (log line) to the group """
+        self.count += 1
+        bytes_sent = to_number(edge.get("bytes_sent"))
+        if bytes_sent is not None:
+            self.bytes_sent += bytes_sent
+        bytes_recvd = to_number(edge.get("bytes_recvd"))
+        if bytes_recvd is not None:
+            self.bytes_recvd += bytes_recvd
+
+        request_time = to_number(edge.get("request_time"))
+        if request_time is not None:
+            self.request_time_count += 1
+            self.request_time_sum += request_time
+            if self.request_time_min is None or request_time < self.request_time_min:
+                self.request_time_min = request_time
+            if self.request_time_max is None or request_time > self.request_time_max:
+                self.request_time_max = request_time
+
+        status = edge.get("status_int")
+        if status is not None:
+            self.status_codes[status] = self.status_codes.get(status, 0) + 1
+
+        timestamp = edge_timestamp(edge)
+        if timestamp is not None:
+            if self.first_seen is None or timestamp < self.first_seen:
+                self.first_seen = timestamp
+            if self.last_seen is None or timestamp > self.last_seen:
+                self.last_seen = timestamp
+
+    def properties(self, label):
+        """ relationship properties of the aggregated edge """
+        properties = WeightedEdge({
+            "type": self.type,
+            "label": label,
+            "count": self.count,
+            "bytes_sent": self.bytes_sent,
+            "bytes_recvd": self.bytes_recvd,
+            "first_seen": format_timestamp(self.first_seen),
+            "last_seen": format_timestamp(self.last_seen),
+        })
+        if self.request_time_count:                                     # no request time stats without times
+            properties["request_time_min"] = self.request_time_min
+            properties["request_time_max"] = self.request_time_max
+            properties["request_time_mean"] = self.request_time_sum / self.request_time_count
+        for status, count in self.status_codes.items():                # one property per status code
+            properties[f"status_{status}"] = count
+        return properties
+
+
+class EdgeAggregator:
+    """
+    collapse repeated edges between the same nodes into one weighted edge
+    """
+
+    def __init__(self) -> None:
+        self.groups = {}        # (node_1, node_2, label) -> EdgeGroup
+
+    def add(self, node_1, node_2, edge):
+        """ add edge to its (node_1, node_2, label) group """
+        key = (node_1, node_2, edge["label"])
+        group = self.groups.get(key)
+        if group is None:
+            group = self.groups[key] = EdgeGroup(edge.get("type", "INFO"))
+        group.add(edge)
+
+    def drain(self):
+        """
+        yield (node_1, node_2, edge) of all groups and start over
+        """
+        groups, self.groups = self.groups, {}
+        for (node_1, node_2, label), group in groups.items():
+            yield node_1, node_2, group.properties(label)
@@ -1,7 +1,19 @@
 """
     this file contains methods for creating graph edges and nodes
 """
+from heapq import merge
 from settings import ENV
+from parallel import parse_file_in_parallel, parse_in_parallel
+from input_reader import read_mmap_lines
+from edge_aggregator import EdgeAggregator, edge_timestamp
+from metrics import timer
+from parsed_record import ParsedRecord
+from transactions import TransactionIndex
+
+REJECT_PARSE_ERROR = "parse_error"              # line does not match any known log format
+REJECT_MISSING_NODE = "missing_node"            # source or destination is '-'
+REJECT_MISSING_FIELD = "missing_field"          # json record misses a required field
+REJECT_UNKNOWN_SERVICE = "unknown_service"      # source or destination service is not mapped
 
 
 class GraphHandler:
@@ -9,80 +21,276 @@ class GraphHandler:
     graph handler class for creating graph
     """
 
-    def __init__(self, neo, parser, logger) -> None:
-        self.neo = neo  # Neo4j Driver
-        self.nodes = []  # graph node names to avoid repeatition
+    def __init__(self, neo, parser, logger, bulk=True, aggregate=False, metrics=None, compact=False,
+                 transactions=False, traffic_matrix=None, deduplicator=None) -> None:
+        self.neo = neo  # graph sink (Neo4jHandler, MemoryGraphSink or NullSink)
+        self.nodes = set()  # graph node names to avoid repeatition
         self.edges = {}  # graph edge names (obsolete)
         self.parser = parser  # log parser object
         self.logger = logger  # logger object (for unprocessible lines)
+        self.bulk = bulk  # buffer nodes and edges and write them in batches
+        self.aggregator = EdgeAggregator() if aggregate else None  # one weighted edge per (node_1, node_2, label)
+        self.metrics = metrics  # pipeline metrics (None = not measured)
+        self.reject_reason = None  # why the last extraction returned None
+        self.compact = compact  # edges are ParsedRecords (shared field names, interned values) instead of dicts
+        self.fields = None  # (layout, values) parsed from the last txt line
+        self.cache_writer = None  # ParseCacheWriter storing the parsed txt lines (None = no cache)
+        self.transaction_index = TransactionIndex() if transactions else None  # hops of each transaction_id
+        self.traffic_matrix = traffic_matrix  # TrafficMatrix fed with every edge (None = not built)
+        self.deduplicator = deduplicator  # Deduplicator dropping repeated lines (None = keep all lines)
+        if metrics is not None and neo is not None:
+            neo.metrics = metrics
 
-    def create_graph_txt(self, lines):
+    def create_graph_txt(self, lines, workers=1, chunk_size=ENV.Parse_CHUNK_SIZE, clear=True):
         """
         create a graph based on input log lings
+
+        with workers > 1 the lines are parsed in a process pool and this
+        process only writes the results (in the original line order),
+        with clear=False the lines are appended to the existing graph
+        :return: reports of the failed write batches
         """
-        self.neo.clear_graph()              # clear the database
-        for i, _line in enumerate(lines):   # iterate through each line
-            result = self.extract_node_edge_from_log(_line)             # extract node and edge info from log line
-            if None in result:
-                self.logger.error(_line)    # log the unprocessible line
-                continue
+        if clear:
+            self.neo.clear_graph()          # clear the database
+        for node_1, node_2, edge in self.records_txt(lines, workers, chunk_size):
+            self.write_node_edge(node_1, node_2, edge)                 # send node, edge info to neo4j handler
+        return self.flush()
 
-            node_1, node_2, edge = result
-            if "none" in edge["label"]:
-                self.logger.error(_line)    # log the unprocessible line
-                continue
+    def create_graph_mmap(self, file_name, workers=1, range_size=ENV.Parse_RANGE_SIZE, clear=True):
+        """
+        create a graph from a memory-mapped .txt file, with workers > 1 the
+        workers parse newline aligned byte ranges of the file
+        :return: reports of the failed write batches
+        """
+        if clear:
+            self.neo.clear_graph()          # clear the database
+        for node_1, node_2, edge in self.records_mmap(file_name, workers, range_size):
+            self.write_node_edge(node_1, node_2, edge)                 # send node, edge info to neo4j handler
+        return self.flush()
 
-            if node_1 not in self.nodes:                                # check if node is not already present                            
-                self.neo.create_new_node(node_1)
-                self.nodes.append(node_1)
-            if node_2 not in self.nodes:
-                self.neo.create_new_node(node_2)
-                self.nodes.append(node_2)
+    def create_graph_json(self, lines, clear=True):
+        """ create graph from json (list of dict objs)"""
+        if clear:
+            self.neo.clear_graph()              # clear the database
+        for node_1, node_2, edge in self.records_json(lines):
+            self.write_node_edge(node_1, node_2, edge)                 # send node, edge info to neo4j handler
+        return self.flush()
 
-            self.neo.create_new_edge(node_1, node_2, edge)
+    def create_graph_cached(self, parsed_lines, clear=True):
+        """ create graph from (line, fields) read from the parse cache, nothing is parsed again """
+        if clear:
+            self.neo.clear_graph()              # clear the database
+        for node_1, node_2, edge in self.records_cached(parsed_lines):
+            self.write_node_edge(node_1, node_2, edge)                 # send node, edge info to neo4j handler
+        return self.flush()
 
-    def create_graph_json(self, lines):
-        """ create graph from json (list of dict objs)"""
-        self.neo.clear_graph()                  # clear the database
-        for i, _line in enumerate(lines):       # iterate through the log lines
+    def create_graph_merged(self, inputs, clear=True):
+        """ create graph from several log files, their records are written in time order """
+        if clear:
+            self.neo.clear_graph()              # clear the database
+        for node_1, node_2, edge in self.records_merged(inputs):
+            self.write_node_edge(node_1, node_2, edge)                 # send node, edge info to neo4j handler
+        return self.flush()
+
+    def load_existing_nodes(self):
+        """ mark the nodes already in the graph as present (append mode) """
+        self.nodes = self.neo.get_node_names()
+
+    def records_txt(self, lines, workers=1, chunk_size=ENV.Parse_CHUNK_SIZE):
+        """
+        yield (node_1, node_2, edge) of the processible log lines
+        """
+        if workers > 1:
+            results = parse_in_parallel(lines, workers, chunk_size, self.compact, self.cache_writer is not None)
+        else:
+            results = ((_line, self.extract_node_edge_from_log(_line), self.reject_reason, self.fields)
+                       for _line in lines)
+        return self.records_results(results)
+
+    def records_mmap(self, file_name, workers=1, range_size=ENV.Parse_RANGE_SIZE):
+        """
+        yield (node_1, node_2, edge) of the processible lines of a memory-mapped .txt file
+        """
+        if workers <= 1:
+            lines = read_mmap_lines(file_name, range_size)
+            if self.metrics is not None:
+                lines = self.metrics.track_lines(lines)
+            return self.records_txt(lines)
+        results = parse_file_in_parallel(file_name, workers, range_size, self.compact, self.cache_writer is not None)
+        if self.metrics is not None:
+            results = self.metrics.track_lines(results)
+        return self.records_results(results)
+
+    def records_results(self, results):
+        """
+        yield (node_1, node_2, edge) from the (line, result, reject reason, fields) of extracted lines
+        """
+        cache_writer = self.cache_writer
+        for _line, result, reason, fields in results:       # iterate through each line
+            if cache_writer is not None:
+                cache_writer.add(_line, fields)
+            if self.is_processible(_line, result, reason):
+                yield result
+        if cache_writer is not None:
+            cache_writer.close()                            # the cache is complete, use it from now on
+            self.cache_writer = None
+
+    def records_cached(self, parsed_lines):
+        """
+        yield (node_1, node_2, edge) of the processible lines of the parse cache
+        """
+        for _line, fields in parsed_lines:
+            result = self.node_edge_from_fields(_line, fields)
+            if self.is_processible(_line, result, self.reject_reason):
+                yield result
+
+    def records_json(self, lines):
+        """
+        yield (node_1, node_2, edge) of the processible json log records
+        """
+        for _line in lines:                 # iterate through the log lines
             result = self.extract_node_edge_from_json(_line)            # extract node, edge info from log line
-            if None in result:
-                self.logger.error(_line)    # log the unprocessible line
-                continue
+            if self.is_processible(_line, result, self.reject_reason):
+                yield result
+
+    def records_merged(self, inputs):
+        """
+        yield (node_1, node_2, edge) of several log files in time order
+
+        :param inputs: (lines, format) of each file, the lines of a file are
+                       expected in time order (streaming k-way merge, no sort)
+        """
+        streams = []
+        for lines, file_format in inputs:
+            if file_format == "json":
+                streams.append(timed_records(self.records_json(lines)))
+            else:
+                streams.append(timed_records(self.records_txt(lines)))
+        for _timestamp, record in merge(*streams, key=record_time):
+            yield record
+
+    def is_processible(self, line, result, reason=None):
+        """ check extracted (node_1, node_2, edge) of a line, log the line if it is unprocessible """
+        if None in result:
+            reason = reason or REJECT_PARSE_ERROR
+        elif "none" in result[2]["label"]:
+            reason = REJECT_UNKNOWN_SERVICE
+        else:
+            reason = None
+        if reason is not None:
+            self.logger.reject(line, reason)    # log the unprocessible line (only here, once)
+            if self.metrics is not None:
+                self.metrics.reject(reason)
+            return False
+        if self.metrics is not None:
+            self.metrics.count("lines_parsed")
+        return True
+
+    def is_duplicate(self, node_1, node_2, edge):
+        """ check if the line was already written (overlapping or rotated files), count it if so """
+        if self.deduplicator is None or not self.deduplicator.is_duplicate(node_1, node_2, edge):
+            return False
+        if self.metrics is not None:
+            self.metrics.count("duplicates_dropped")
+        return True
+
+    def write_node_edge(self, node_1, node_2, edge):
+        """ create missing nodes and the edge between them """
+        if self.is_duplicate(node_1, node_2, edge):
+            return
+        if self.bulk:
+            create_node, create_edge = self.neo.queue_node, self.neo.queue_edge
+        else:
+            create_node, create_edge = self.neo.create_new_node, self.neo.create_new_edge
+
+        if node_1 not in self.nodes:                                # check if node is not already present
+            create_node(node_1)
+            self.nodes.add(node_1)
+            if self.metrics is not None:
+                self.metrics.count("nodes_created")
+        if node_2 not in self.nodes:
+            create_node(node_2)
+            self.nodes.add(node_2)
+            if self.metrics is not None:
+                self.metrics.count("nodes_created")
 
-            node_1, node_2, edge = result
-            if "none" in edge["label"]:
-                self.logger.error(_line)    # log the unprocessible line
-                continue
+        if self.transaction_index is not None:
+            self.transaction_index.add(node_1, node_2, edge)       # written as transaction summaries when idle
+            if self.transaction_index.due():
+                self.write_transactions(self.transaction_index.drain_idle())
+        if self.traffic_matrix is not None:
+            self.traffic_matrix.add(node_1, node_2, edge)
+        if self.aggregator is not None:
+            self.aggregator.add(node_1, node_2, edge)              # written as one weighted edge on flush
+        else:
+            create_edge(node_1, node_2, edge)
+            if self.metrics is not None:
+                self.metrics.count("edges_created")
 
-            if node_1 not in self.nodes:                                # check if nodes are not already present
-                self.neo.create_new_node(node_1)
-                self.nodes.append(node_1)
-            if node_2 not in self.nodes:
-                self.neo.create_new_node(node_2)
-                self.nodes.append(node_2)
+    def write_transactions(self, summaries):
+        """ write the transaction summaries (TransactionIndex) to the sink """
+        if self.metrics is not None:
+            self.metrics.count("transactions_indexed", len(summaries))
+        self.neo.write_transactions(summaries)
 
-            self.neo.create_new_edge(node_1, node_2, edge)              # send node, edge info to neo4j handler
+    def flush(self):
+        """ write the buffered (or aggregated) nodes and edges, report the failed batches """
+        if self.aggregator is not None:
+            create_edge = self.neo.queue_edge if self.bulk else self.neo.create_new_edge
+            for node_1, node_2, edge in self.aggregator.drain():
+                create_edge(node_1, node_2, edge)
+                if self.metrics is not None:
+                    self.metrics.count("edges_created")
+        if self.transaction_index is not None:
+            self.write_transactions(list(self.transaction_index.drain()))
+        if not self.bulk:
+            return []
+        with timer(self.metrics, "flush"):
+            failed_batches = self.neo.flush()
+        for report in failed_batches:
+            print(f"batch {report['batch']} ({report['size']} {report['kind']}) failed: {report['error']}")
+        return failed_batches
 
     def extract_node_edge_from_log(self, line):
         """
         extract nodes and edges from log lines
         """
         try:
-            parsed_log = self.parser.parse_log(line)                    # parse the log
+            self.fields = self.parser.parse_fields(line)                # parse the log
+        except Exception as e:
+            self.fields = None
+        return self.node_edge_from_fields(line, self.fields)
+
+    def node_edge_from_fields(self, line, fields):
+        """
+        extract nodes and edges from the parsed fields (layout, values) of a log line
+        """
+        self.reject_reason = None
+        try:
+            layout, values = fields
+            if self.compact:
+                parsed_log = ParsedRecord(layout, list(values))
+            else:
+                parsed_log = dict(zip(layout.names, values))
             node_1 = parsed_log["remote_addr"]
             node_2 = parsed_log["destination_server"]
-            source, method, destination = self.get_source_destination(      # get source, edge & destination info
-                parsed_log)
-            edge_label = f"{source}_{method}_{destination}"
 
         except Exception as e:
-            self.logger.error(line)                                     # log the unprocessible
             # print(f"error: {e}, log line: {line}")
+            self.reject_reason = REJECT_PARSE_ERROR                     # logged by is_processible
+            return None, None, None
+
+        try:
+            source, method, destination = self.get_source_destination(      # get source, edge & destination info
+                parsed_log)
+        except KeyError:
+            self.reject_reason = REJECT_UNKNOWN_SERVICE                 # every layout has the service fields
             return None, None, None
+        edge_label = f"{source}_{method}_{destination}"
 
         try:
             if node_1 == "-" or node_2 == "-":                          # skip if node = -
+                self.reject_reason = REJECT_MISSING_NODE
                 return None, None, None
 
             node_1 = node_1.replace("m-", "m_")
@@ -110,7 +318,7 @@ class GraphHandler:
         else:
             _type = "INFO"
 
-        message = parsed_log["message"][0:90].replace("'", "")         # truncate long messages
+        message = parsed_log["message"][0:90]                          # truncate long messages
 
         parsed_log["type"] = _type
         parsed_log["label"] = edge_label
@@ -177,12 +385,14 @@ class GraphHandler:
         return method
 
     def extract_node_edge_from_json(self, line):
+        self.reject_reason = None
         try:
             if line["remote_addr"] in ENV.server_names:
                 node_1 = ENV.server_names[line["remote_addr"]]              # map server names
             else:
                 node_1 = line["remote_addr"]
                 if node_1 == "-":
+                    self.reject_reason = REJECT_MISSING_NODE
                     return None, None, None
 
             node_2_temp = line["sysloghost"]
@@ -208,6 +418,7 @@ class GraphHandler:
             if "." in node_2:
                 node_2 = f"IP_{node_2}".replace(".", "_")
         except Exception as e:
+            self.reject_reason = REJECT_MISSING_FIELD
             return None, None, None
 
         for key in line:                                                           # add all other (key,values)
@@ -219,4 +430,26 @@ class GraphHandler:
                         " ")
                 except Exception as e:
                     edge[key] = line[key]
+        if "@timestamp" in line and "timestamp" not in edge:
+            edge["timestamp"] = line["@timestamp"]                                  # '@' keys are not stored, the time is
+        if self.compact:
+            edge = ParsedRecord.from_dict(edge)
         return node_1, node_2, edge
+
+
+def timed_records(records):
+    """
+    yield (timestamp, record) of (node_1, node_2, edge) records, records
+    without time get the time of the record before them (0 at the start)
+    """
+    timestamp = 0.0
+    for record in records:
+        record_timestamp = edge_timestamp(record[2])
+        if record_timestamp is not None:
+            timestamp = record_timestamp
+        yield timestamp, record
+
+
+def record_time(timed_record):
+    """ merge key of timed_records """
+    return timed_record[0]
@@ -0,0 +1,227 @@
+"""
+this file contains the graph sink interface and the sinks which do not need Neo4j
+"""
+from abc import ABC, abstractmethod
+from array import array
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from transactions import merge_summaries
+
+
+class GraphSink(ABC):
+    """graph sink
+
+    interface of the graph writers used by GraphHandler and RealTimeDrawer,
+    a sink missing one of the abstract methods can not be created
+    """
+
+    metrics = None      # pipeline metrics, set by GraphHandler
+
+    @abstractmethod
+    def create_new_node(self, node: str):
+        """ create new node named (node) """
+
+    @abstractmethod
+    def merge_new_node(self, node: str):
+        """ create node named (node) if it does not exist yet """
+
+    @abstractmethod
+    def create_new_edge(self, node_1: str, node_2: str, edge: Dict):
+        """ create new edge from node_1 to node_2 """
+
+    @abstractmethod
+    def get_node_names(self) -> set:
+        """ get names of all nodes in the graph """
+
+    @abstractmethod
+    def clear_graph(self, progress: Optional[Callable] = None) -> int:
+        """ clear the graph """
+
+    def queue_node(self, node: str) -> None:
+        """ buffer node for a bulk write (unbuffered by default) """
+        self.create_new_node(node)
+
+    def queue_edge(self, node_1: str, node_2: str, edge: Dict) -> None:
+        """ buffer edge for a bulk write (unbuffered by default) """
+        self.create_new_edge(node_1, node_2, edge)
+
+    def flush(self) -> List[Dict]:
+        """write buffered nodes and edges
+
+        :return: reports of the failed batches
+        """
+        return []
+
+    def write_transactions(self, transactions: Iterable[Dict]) -> None:
+        """ store transaction summaries (TransactionIndex.drain), dropped by default """
+        for _ in transactions:
+            pass
+
+
+class MemoryGraphSink(GraphSink):
+    """in-memory graph sink
+
+    node and label names are stored once and referenced by integer ids,
+    edges are kept in parallel arrays with a per node adjacency array, so
+    the graph can be queried after an offline run
+    """
+
+    def __init__(self, keep_properties: bool = True) -> None:
+        self.keep_properties = keep_properties  # store edge properties (disable to measure the structure only)
+        self.reset()
+
+    def clear_graph(self, progress: Optional[Callable] = None) -> int:
+        deleted = len(self.node_names) + len(self.edge_labels)
+        self.reset()
+        return deleted
+
+    def reset(self) -> None:
+        """ start with an empty graph """
+        self.node_ids = {}                  # node name -> node id
+        self.node_names = []                # node id -> node name
+        self.label_ids = {}                 # edge label -> label id
+        self.label_names = []               # label id -> edge label
+        self.edge_sources = array("l")      # edge id -> source node id
+        self.edge_targets = array("l")      # edge id -> destination node id
+        self.edge_labels = array("l")       # edge id -> label id
+        self.edge_properties = []           # edge id -> properties (if keep_properties)
+        self.out_edges = []                 # node id -> array of outgoing edge ids
+        self.in_edges = []                  # node id -> array of incoming edge ids
+        self.transactions = {}              # transaction id -> summary (side index of write_transactions)
+
+    def create_new_node(self, node: str) -> int:
+        """create new node named (node), node names are unique
+
+        :return: node id
+        """
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            node_id = self.node_ids[node] = len(self.node_names)
+            self.node_names.append(node)
+            self.out_edges.append(array("l"))
+            self.in_edges.append(array("l"))
+        return node_id
+
+    merge_new_node = create_new_node
+
+    def create_new_edge(self, node_1: str, node_2: str, edge: Dict) -> Optional[int]:
+        """create new edge from node_1 to node_2, nothing is created if a node is missing (like MATCH)
+
+        :return: edge id
+        """
+        source = self.node_ids.get(node_1)
+        target = self.node_ids.get(node_2)
+        if source is None or target is None:
+            return None
+        label = edge["label"]
+        label_id = self.label_ids.get(label)
+        if label_id is None:
+            label_id = self.label_ids[label] = len(self.label_names)
+            self.label_names.append(label)
+
+        edge_id = len(self.edge_labels)
+        self.edge_sources.append(source)
+        self.edge_targets.append(target)
+        self.edge_labels.append(label_id)
+        if self.keep_properties:
+            self.edge_properties.append(dict(edge))
+        self.out_edges[source].append(edge_id)
+        self.in_edges[target].append(edge_id)
+        return edge_id
+
+    def get_node_names(self) -> set:
+        return set(self.node_names)
+
+    def node_count(self) -> int:
+        return len(self.node_names)
+
+    def edge_count(self) -> int:
+        return len(self.edge_labels)
+
+    def label_counts(self) -> Dict[str, int]:
+        """ number of edges per label """
+        counts = [0] * len(self.label_names)
+        for label_id in self.edge_labels:
+            counts[label_id] += 1
+        return dict(zip(self.label_names, counts))
+
+    def neighbors(self, node: str) -> set:
+        """ names of the destination nodes of the outgoing edges of (node) """
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            return set()
+        return {self.node_names[self.edge_targets[edge_id]] for edge_id in self.out_edges[node_id]}
+
+    def edges(self, node_1: Optional[str] = None, node_2: Optional[str] = None,
+              label: Optional[str] = None) -> Iterator[Tuple[str, str, str, Optional[Dict]]]:
+        """yield (node_1, node_2, label, properties) of the matching edges
+
+        :param node_1: source node name (any if None)
+        :param node_2: destination node name (any if None)
+        :param label: edge label (any if None)
+        """
+        if node_1 is not None:
+            if node_1 not in self.node_ids:
+                return
+            edge_ids = self.out_edges[self.node_ids[node_1]]
+        elif node_2 is not None:
+            if node_2 not in self.node_ids:
+                return
+            edge_ids = self.in_edges[self.node_ids[node_2]]
+        else:
+            edge_ids = range(len(self.edge_labels))
+        target = self.node_ids.get(node_2) if node_2 is not None else None
+        label_id = self.label_ids.get(label) if label is not None else None
+        if (node_2 is not None and target is None) or (label is not None and label_id is None):
+            return
+
+        for edge_id in edge_ids:
+            if target is not None and self.edge_targets[edge_id] != target:
+                continue
+            if label_id is not None and self.edge_labels[edge_id] != label_id:
+                continue
+            yield (
+                self.node_names[self.edge_sources[edge_id]],
+                self.node_names[self.edge_targets[edge_id]],
+                self.label_names[self.edge_labels[edge_id]],
+                self.edge_properties[edge_id] if self.keep_properties else None,
+            )
+
+    def write_transactions(self, transactions: Iterable[Dict]) -> None:
+        """ keep transaction summaries, the hops of a transaction seen again are appended """
+        for summary in transactions:
+            old = self.transactions.get(summary["transaction_id"])
+            self.transactions[summary["transaction_id"]] = summary if old is None else merge_summaries(old, summary)
+
+    def transaction(self, transaction_id: str) -> Optional[Dict]:
+        """ summary (ordered hops, start, end, latency) of (transaction_id) """
+        return self.transactions.get(transaction_id)
+
+
+class NullSink(GraphSink):
+    """null sink
+
+    drops everything and only counts, for measuring raw parse throughput
+    """
+
+    def __init__(self) -> None:
+        self.nodes = 0
+        self.edges = 0
+
+    def create_new_node(self, node: str) -> None:
+        self.nodes += 1
+
+    def merge_new_node(self, node: str) -> None:
+        self.nodes += 1
+
+    def create_new_edge(self, node_1: str, node_2: str, edge: Dict) -> None:
+        self.edges += 1
+
+    def get_node_names(self) -> set:
+        return set()
+
+    def clear_graph(self, progress: Optional[Callable] = None) -> int:
+        deleted = self.nodes + self.edges
+        self.nodes = 0
+        self.edges = 0
+        return deleted
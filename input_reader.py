@@ -0,0 +1,274 @@
+"""
+    this file contains generators for streaming log lines from the input files
+"""
+import bz2
+import gzip
+import lzma
+import mmap
+import sys
+from glob import glob, has_magic
+from json import JSONDecoder, JSONDecodeError, loads
+from os import path as os_path
+from os import walk as os_walk
+from queue import Queue
+from threading import Thread
+
+
+COMPRESSED_OPENERS = {                  # transparent decompression by file suffix
+    ".gz": gzip.open,
+    ".bz2": bz2.open,
+    ".xz": lzma.open,
+}
+FORMATS = {                             # input file extensions and their log format
+    ".txt": "txt",
+    ".log": "txt",
+    ".json": "json",
+    ".ndjson": "json",
+}
+READ_CHUNK_SIZE = 65536                 # characters read at once from json inputs
+SNIFF_SIZE = 4096                       # characters read to detect the format of a file without known suffix
+PREFETCH_BATCH_SIZE = 1000              # items handed over from a prefetch thread at once
+PREFETCH_QUEUE_SIZE = 16                # batches a prefetch thread reads ahead
+
+
+def open_input(file_name):
+    """
+    open the input file in text mode, '-' reads from stdin
+    """
+    if file_name == "-":
+        return sys.stdin
+    for suffix, opener in COMPRESSED_OPENERS.items():
+        if file_name.endswith(suffix):
+            return opener(file_name, "rt")
+    return open(file_name)
+
+
+def detect_format(file_name):
+    """
+    get the log format (txt or json) from the file suffix, None if unknown
+    """
+    name, extension = os_path.splitext(file_name)
+    if extension in COMPRESSED_OPENERS:                         # proxy.txt.gz -> .txt
+        extension = os_path.splitext(name)[1]
+    return FORMATS.get(extension)
+
+
+def sniff_format(file_name):
+    """
+    get the log format from the content: json if the first character is
+    '{' or '[' (NDJSON or a json array), txt otherwise, None if the file is empty
+    """
+    with open_input(file_name) as f:
+        head = f.read(SNIFF_SIZE).lstrip()
+    if not head:
+        return None
+    return "json" if head[0] in "{[" else "txt"
+
+
+def expand_inputs(names):
+    """
+    expand input names into log files: globs are matched, directories are
+    searched (recursively) for files with a known log suffix, file names
+    and '-' (stdin) are kept as they are
+
+    :return: file names in order, each file once
+    """
+    files = []
+    for name in names:
+        if name != "-" and has_magic(name):
+            matches = sorted(glob(name, recursive=True))
+        elif os_path.isdir(name):
+            matches = sorted(
+                os_path.join(directory, file_name)
+                for directory, _, file_names in os_walk(name)
+                for file_name in file_names
+                if detect_format(file_name) is not None
+            )
+        else:
+            matches = [name]
+        files.extend(match for match in matches if not os_path.isdir(match))
+    return list(dict.fromkeys(files))
+
+
+def prefetch(items, batch_size=PREFETCH_BATCH_SIZE, queue_size=PREFETCH_QUEUE_SIZE):
+    """
+    yield (items) read by a background thread (reading and decompressing
+    of several inputs overlap), the thread waits while (queue_size)
+    batches are not consumed; errors of the thread are raised here
+    """
+    queue = Queue(maxsize=queue_size)
+
+    def read():
+        try:
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    queue.put(batch)
+                    batch = []
+            if batch:
+                queue.put(batch)
+            queue.put(None)                                     # end of the input
+        except Exception as e:
+            queue.put(e)
+
+    Thread(target=read, name="prefetch", daemon=True).start()
+    while True:
+        batch = queue.get()
+        if batch is None:
+            return
+        if isinstance(batch, Exception):
+            raise batch
+        yield from batch
+
+
+def read_txt_lines(f):
+    """
+    yield the log lines one by one (without the trailing new line)
+    """
+    for line in f:
+        yield line.rstrip("\n")
+
+
+def read_line_chunks(f, offset, chunk_size):
+    """
+    read complete lines of a binary file from (offset) on
+
+    :return: generator of ([lines], offset after the last line), a partial
+             last line (still being written) is left for the next read
+    """
+    f.seek(offset)
+    lines = []
+    for raw_line in f:
+        if not raw_line.endswith(b"\n"):
+            break
+        offset += len(raw_line)
+        lines.append(raw_line.decode("utf-8", errors="replace").rstrip("\r\n"))
+        if len(lines) >= chunk_size:
+            yield lines, offset
+            lines = []
+    if lines:
+        yield lines, offset
+
+
+def byte_ranges(mapped, range_size):
+    """
+    split a memory-mapped file into (start, end) byte ranges of about
+    range_size bytes, every range ends after a new line (or at the end of the file)
+    """
+    size = len(mapped)
+    start = 0
+    while start < size:
+        end = start + range_size
+        if end >= size:
+            end = size
+        else:
+            newline = mapped.find(b"\n", end - 1)              # the range ends with the line crossing range_size
+            end = size if newline == -1 else newline + 1
+        yield start, end
+        start = end
+
+
+def range_lines(mapped, start, end):
+    """
+    decode the lines of a byte range (like text mode: new lines removed, \r\n and \r are new lines)
+    """
+    text = mapped[start:end].decode("utf-8", errors="replace")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop()                                             # the range ends with a new line
+    return lines
+
+
+def map_file(file_name):
+    """ memory-map a file read only, None if it is empty (empty files can not be mapped) """
+    with open(file_name, "rb") as f:
+        if os_path.getsize(file_name) == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_mmap_lines(file_name, range_size):
+    """
+    yield the lines of a memory-mapped file, one byte range is decoded at a time
+    """
+    mapped = map_file(file_name)
+    if mapped is None:
+        return
+    with mapped:
+        for start, end in byte_ranges(mapped, range_size):
+            yield from range_lines(mapped, start, end)
+
+
+def parse_json_line(line):
+    """
+    parse one NDJSON line, the line itself is returned if it is not valid json
+    (so it is logged as unprocessible)
+    """
+    try:
+        return loads(line)
+    except JSONDecodeError:
+        return line
+
+
+def read_json_records(f, chunk_size=READ_CHUNK_SIZE):
+    """
+    yield log records one by one from a json array or from NDJSON
+    (one json object per line), only a chunk of the file is kept in memory
+
+    an NDJSON line which is not valid json is yielded as the line itself
+    (like parse_json_line, so it is logged as unprocessible) and reading
+    goes on with the next line; a record which is not complete yet makes
+    the reader read (twice as much) more
+    """
+    decoder = JSONDecoder()
+    buffer = ""
+    position = 0                                                # start of the next record in buffer
+    in_array = False
+    started = False
+    eof = False
+    read_size = chunk_size
+    while True:
+        decoded = False
+        while True:
+            while position < len(buffer) and (buffer[position].isspace() or (in_array and buffer[position] == ",")):
+                position += 1                                   # skip white spaces and array separators
+            if position >= len(buffer):
+                break
+            if not started:
+                started = True
+                if buffer[position] == "[":                     # records are wrapped in a json array
+                    in_array = True
+                    position += 1
+                    continue
+            if in_array and buffer[position] == "]":
+                return
+            try:
+                record, position = decoder.raw_decode(buffer, position)
+            except JSONDecodeError:
+                if in_array:
+                    if eof:
+                        raise
+                    break                                       # record is not complete yet, read more
+                end = buffer.find("\n", position)
+                if end == -1 and not eof:
+                    break                                       # line is not complete yet, read more
+                if end == -1:
+                    end = len(buffer)
+                yield buffer[position:end].rstrip("\r")           # not valid json, skip the line
+                position = end + 1
+                decoded = True
+                continue
+            decoded = True
+            yield record
+
+        if eof:
+            return
+        read_size = chunk_size if decoded else 2 * read_size    # a long record is not decoded again per chunk
+        chunk = f.read(read_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[position:] + chunk                      # only the incomplete tail is kept
+        position = 0
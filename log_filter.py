@@ -1,7 +1,47 @@
 """
     this file contains the filters applied on the swift log lines
 """
-from re import search as regex_search
+from re import compile as regex_compile
+from string import ascii_lowercase
+from sys import intern
+
+from parsed_record import ParsedRecord, RecordLayout
+
+
+PARSER_VERSION = 1                      # bump when the parsed fields change (invalidates the parse caches)
+SERVER_TAG = "-server: "                # separates the syslog header from the service log
+STDERR_TAG = "STDERR: "                 # prefix of proxy error lines
+ACCESS_SERVERS = ("object", "container", "account")
+
+# patterns are compiled once at import time
+HTTP_HOST_PORT_PATTERN = regex_compile(r"http:\/\/.*\:([0-9])*\/")
+IP_PATTERN = regex_compile(r"([0-9])*\.([0-9])*\.([0-9])*\.([0-9])*")
+IP_PORT_TUPLE_PATTERN = regex_compile(r"\(\'([0-9])*\.([0-9])*\.([0-9])*\.\w+\', ([0-9])*\)")
+HTTP_IP_PORT_PATTERN = regex_compile(r"http:\/\/([0-9])*\.([0-9])*\.([0-9])*\.([0-9])*\:([0-9])*\/")
+PORT_KEY_PATTERN = regex_compile(r"port'\: ([0-9])*")
+PORT_PATTERN = regex_compile(r"\:([0-9])*\/")
+HTTP_HOST_PATTERN = regex_compile(r"http://(.*)\:([0-9])*")
+
+# field names of the parsed line formats, in the order of the extracted values
+# (the extractors intern the low cardinality values themselves)
+ACCESS_LAYOUT = RecordLayout.get((
+    "destination_server", "program_name", "remote_addr", "datetime", "method", "path",
+    "status_int", "content_length", "referer", "transaction_id", "user_agent", "request_time",
+    "additional_info", "server_pid", "policy_index", "source_service", "message",
+))
+PROXY_ERROR_LAYOUT = RecordLayout.get((
+    "destination_server", "program_name", "remote_addr", "datetime", "method", "path",
+    "protocol", "status_int", "transaction_id", "source_service", "message",
+))
+PROXY_ERROR_MESSAGE_LAYOUT = RecordLayout.get((             # STDERR lines which are not requests
+    "destination_server", "program_name", "remote_addr", "method", "message", "source_service",
+))
+PROXY_ACCESS_LAYOUT = RecordLayout.get((
+    "destination_server", "program_name", "client_ip", "remote_addr", "datetime", "method",
+    "path", "protocol", "status_int", "referer", "user_agent", "auth_token", "bytes_recvd",
+    "bytes_sent", "client_etag", "transaction_id", "headers", "request_time", "source",
+    "log_info", "start_time", "end_time", "policy_index", "source_service", "message",
+))
 
 
 class LogFilter:
@@ -48,7 +88,7 @@ class LogFilter:
                 return None
 
         ip = None
-        u = regex_search(r"http:\/\/.*\:([0-9])*\/", line)
+        u = HTTP_HOST_PORT_PATTERN.search(line)
         # look for http://xxx:PORT patterns
         if u:
             url = u.group()
@@ -56,7 +96,7 @@ class LogFilter:
             ip = url.split(":")[0]
             port = url.split(":")[1][0:-1]
             return map_ip(ip)
-        u = regex_search(r"([0-9])*\.([0-9])*\.([0-9])*\.([0-9])*", line)
+        u = IP_PATTERN.search(line)
         # look for x.x.x.x patterns
         if u:
             ip = u.group()
@@ -68,17 +108,14 @@ class LogFilter:
         """
         # line = line.decode('utf-8')   # this is for storlet
         port = None
-        u = regex_search(r"\(\'([0-9])*\.([0-9])*\.([0-9])*\.\w+\', ([0-9])*\)", line)
+        u = IP_PORT_TUPLE_PATTERN.search(line)
         # (x.x.x.x, PORT)
         if u:
             ip_port = u.group()
-            ip = regex_search(r"\'([0-9])*\.([0-9])*\.([0-9])*\.\w+\'", ip_port)
             port = ip_port.split(", ")[1][0:-1]
             return port
 
-        u = regex_search(
-            r"http:\/\/([0-9])*\.([0-9])*\.([0-9])*\.([0-9])*\:([0-9])*\/", line
-        )
+        u = HTTP_IP_PORT_PATTERN.search(line)
         # look for http://x.x.x.x:PORT pattern
         if u:
             url = u.group()
@@ -86,21 +123,21 @@ class LogFilter:
             return port
 
         # look for 'port: XXXX' pattern
-        u = regex_search(r"port'\: ([0-9])*", line)
+        u = PORT_KEY_PATTERN.search(line)
         if u:
             string = u.group()
             port = string.split(": ")[1]
             return port
         
         # look for 'http://xxxx:PORT pattern
-        u = regex_search(r"http:\/\/.*\:([0-9])*\/", line)
+        u = HTTP_HOST_PORT_PATTERN.search(line)
         if u:
             url = u.group()
             url = url.split("http://")[1]
             ip = url.split(":")[0]
             port = url.split(":")[1][0:-1]
             return port
-        u = regex_search(r"\:([0-9])*\/", line)
+        u = PORT_PATTERN.search(line)
         if u:
             url = u.group()
             port = url[1:-1]
@@ -121,7 +158,7 @@ class LogFilter:
         """
         # line = line.decode('utf-8')
         host = None
-        u = regex_search(r"http://(.*)\:([0-9])*", line)
+        u = HTTP_HOST_PATTERN.search(line)
         if u:
             url = u.group()
             host = url.split("http://")[1].split(":")[0]
@@ -131,90 +168,134 @@ class LogFilter:
     def parse_log(self, line):
         """
         parse swift log lines, extract all properties
+
+        the line is split once, its format is recognized from the service
+        name in front of '-server: ' and a dedicated extractor builds the fields
+        :return: dict of the fields, None if the line has no known format
         """
-        u = regex_search(r"([a-z])*\-server: ", line)
-        if u is None:
+        fields = self.parse_fields(line)
+        if fields is None:
             return None
+        layout, values = fields
+        return dict(zip(layout.names, values))
 
-        server = line.split(" ")[3]
-        temp = u.group().split("-")[0]
-        if temp in ["object", "container", "account"]:
-            items = line.split("-server: ")[1].split(" ")
-            try:
-                return {
-                    "destination_server": server,
-                    "program_name": temp,
-                    "remote_addr": items[0],
-                    "datetime": f"{items[3]} {items[4]}"[1:-1],
-                    "method": items[5][1:],
-                    "path": items[6][:-1],
-                    "status_int": items[7],
-                    "content_length": items[8],
-                    "referer": f"{items[9]} {items[10]}"[1:-1],
-                    "transaction_id": items[11][1:-1],
-                    "user_agent": f"{items[12]} {items[13]}"[1:-1],
-                    "request_time": items[14],
-                    "additional_info": items[15][1:-1],
-                    "server_pid": items[16],
-                    "policy_index": items[17],
-                    "source_service": f"{items[12]}".split("-server")[0][1:],
-                    "message": "none",
-                }
-            except Exception as e:
-                pass
-        if temp in ["proxy"]:
-            if "STDERR" in line:
-                items = line.split("STDERR: ")[1].split(" ")
-                try:
-                    return {
-                        "destination_server": server,
-                        "program_name": f"{temp}",
-                        "remote_addr": items[0],
-                        "datetime": f"{items[3]} {items[4]}"[1:-1],
-                        "method": items[5][1:],
-                        "path": items[6],
-                        "protocol": items[7][:-1],
-                        "status_int": items[8],
-                        "transaction_id": items[12][:-1],
-                        "source_service": "none",
-                        "message": line.split("STDERR: ")[1],
-                    }
-                except Exception as e:
-                    return {
-                        "destination_server": server,
-                        "program_name": f"{temp}",
-                        "remote_addr": self.contains_ip(line.split("STDERR: ")[1]),
-                        "method": "none",
-                        "message": line.split("STDERR: ")[1],
-                        "source_service": "none",
-                    }
+    def parse_record(self, line):
+        """
+        parse swift log lines like parse_log, as a compact ParsedRecord
+        """
+        fields = self.parse_fields(line)
+        if fields is None:
+            return None
+        layout, values = fields
+        return ParsedRecord(layout, list(values))
+
+    def parse_fields(self, line):
+        """
+        :return: (layout, field values) of the line, None if the line has no known format
+        """
+        tag = line.find(SERVER_TAG)
+        if tag == -1:
+            return None
 
+        header = line[:tag]
+        program_name = header[len(header.rstrip(ascii_lowercase)):]    # service name right before '-server: '
+        if program_name in ACCESS_SERVERS:
+            extractor = self.parse_access_log
+        elif program_name == "proxy":
+            if "STDERR" in line:
+                extractor = self.parse_proxy_error_log
             else:
-                items = line.split("-server: ")[1].split(" ")
-                return {
-                    "destination_server": server,
-                    "program_name": temp,
-                    "client_ip": items[0],
-                    "remote_addr": items[1],
-                    "datetime": items[2],
-                    "method": items[3],
-                    "path": items[4],
-                    "protocol": items[5],
-                    "status_int": items[6],
-                    "referer": items[7],
-                    "user_agent": items[8],
-                    "auth_token": items[9],
-                    "bytes_recvd": items[10],
-                    "bytes_sent": items[11],
-                    "client_etag": items[12],
-                    "transaction_id": items[13],
-                    "headers": items[14],
-                    "request_time": items[15],
-                    "source": items[16],
-                    "log_info": items[17],
-                    "start_time": items[18],
-                    "end_time": items[19],
-                    "policy_index": items[20],
-                    "source_service": f"{items[8]}".split("-server")[0],
-                    "message": "none",
-                }
+                extractor = self.parse_proxy_access_log
+        else:
+            return None
+
+        try:
+            server = line.split(" ", 4)[3]                             # syslog host name
+        except IndexError:
+            return None
+        body = line[tag + len(SERVER_TAG):]
+        end = body.find(SERVER_TAG)
+        if end != -1:
+            body = body[:end]
+        return extractor(line, intern(server), intern(program_name), body)
+
+    def parse_access_log(self, line, server, program_name, body):
+        """
+        extract fields of object/container/account server access log lines
+        """
+        items = body.split(" ")
+        try:
+            return ACCESS_LAYOUT, (
+                server,                                         # destination_server
+                program_name,                                   # program_name
+                items[0],                                       # remote_addr
+                f"{items[3]} {items[4]}"[1:-1],                 # datetime
+                intern(items[5][1:]),                           # method
+                items[6][:-1],                                  # path
+                intern(items[7]),                               # status_int
+                items[8],                                       # content_length
+                f"{items[9]} {items[10]}"[1:-1],                # referer
+                items[11][1:-1],                                # transaction_id
+                f"{items[12]} {items[13]}"[1:-1],               # user_agent
+                items[14],                                      # request_time
+                items[15][1:-1],                                # additional_info
+                items[16],                                      # server_pid
+                intern(items[17]),                              # policy_index
+                intern(items[12].split("-server")[0][1:]),      # source_service
+                "none",                                         # message
+            )
+        except IndexError:
+            return None
+
+    def parse_proxy_error_log(self, line, server, program_name, body):
+        """
+        extract fields of proxy STDERR lines
+        """
+        start = line.find(STDERR_TAG)
+        if start == -1:
+            return None
+        message = line[start + len(STDERR_TAG):]
+        end = message.find(STDERR_TAG)
+        if end != -1:
+            message = message[:end]
+
+        items = message.split(" ")
+        try:
+            return PROXY_ERROR_LAYOUT, (
+                server,                                         # destination_server
+                program_name,                                   # program_name
+                items[0],                                       # remote_addr
+                f"{items[3]} {items[4]}"[1:-1],                 # datetime
+                intern(items[5][1:]),                           # method
+                items[6],                                       # path
+                intern(items[7][:-1]),                          # protocol
+                intern(items[8]),                               # status_int
+                items[12][:-1],                                 # transaction_id
+                "none",                                         # source_service
+                message,                                        # message
+            )
+        except IndexError:
+            return PROXY_ERROR_MESSAGE_LAYOUT, (
+                server,                                         # destination_server
+                program_name,                                   # program_name
+                self.contains_ip(message),                      # remote_addr
+                "none",                                         # method
+                message,                                        # message
+                "none",                                         # source_service
+            )
+
+    def parse_proxy_access_log(self, line, server, program_name, body):
+        """
+        extract fields of proxy access log lines
+        """
+        items = body.split(" ")
+        if len(items) < 21:
+            return None
+        items[3] = intern(items[3])                             # method
+        items[6] = intern(items[6])                             # status_int
+        items[20] = intern(items[20])                           # policy_index
+        return PROXY_ACCESS_LAYOUT, (
+            server, program_name, *items[:21],                  # destination_server, program_name, client_ip ... policy_index
+            intern(items[8].split("-server")[0]),               # source_service
+            "none",                                             # message
+        )
@@ -0,0 +1,202 @@
+"""
+    this file contains a deterministic generator of synthetic swift logs
+"""
+import argparse
+import json
+import sys
+from random import Random
+from time import gmtime, strftime
+
+DEFAULT_MIX = {                         # share of each line kind
+    "proxy_access": 0.30,
+    "proxy_stderr": 0.05,
+    "object": 0.35,
+    "container": 0.15,
+    "account": 0.10,
+    "malformed": 0.05,
+}
+METHODS = ("GET", "GET", "GET", "PUT", "HEAD", "DELETE", "POST", "COPY")
+STATUS_CODES = ("200", "200", "200", "201", "204", "404", "499", "503")
+CLIENT_AGENTS = ("python-swiftclient-3.5.0", "Swift")
+BACKEND_AGENTS = (                      # user agents of storage requests (updaters are not mapped, rejected)
+    "proxy-server", "proxy-server", "proxy-server", "proxy-server", "proxy-server",
+    "proxy-server", "container-server", "container-server", "object-updater",
+)
+
+
+class SwiftLogGenerator:
+    """
+    generate swift proxy/object/container/account log lines (and their
+    json/syslog form), the same seed always gives the same logs
+    """
+
+    def __init__(self, seed=0, mix=None, hosts=8, clients=4, start_time=1649000000.0, rate=100.0) -> None:
+        self.random = Random(seed)
+        mix = mix or DEFAULT_MIX
+        self.kinds = list(mix)
+        self.weights = [mix[kind] for kind in self.kinds]
+        self.hosts = [                                          # (host name, ip) of storage nodes
+            (f"m{i + 1}-r1z1s1", f"172.20.{(i + 2) // 256}.{(i + 2) % 256}") for i in range(hosts)
+        ]
+        self.proxy = self.hosts[0]                              # proxy runs on the first node
+        self.clients = [f"172.21.{i // 256}.{i % 256 + 1}" for i in range(clients)] + ["172.20.0.1"]
+        self.time = start_time
+        self.rate = rate                                        # lines per second of log time
+        self.transaction = 0
+
+    def next_time(self):
+        """ advance the log clock """
+        self.time += self.random.expovariate(self.rate)
+        return self.time
+
+    def next_transaction_id(self):
+        self.transaction += 1
+        return f"tx{self.transaction:021x}-00{int(self.time):x}"
+
+    def lines(self, count):
+        """ yield (count) text log lines """
+        choose = self.random.choices
+        for kinds in iter(lambda: choose(self.kinds, self.weights, k=1024), None):
+            for kind in kinds:
+                if count <= 0:
+                    return
+                count -= 1
+                yield getattr(self, f"{kind}_line")()
+
+    def syslog_header(self, host, program_name):
+        return f"{strftime('%b %d %H:%M:%S', gmtime(self.time))} {host} {program_name}:"
+
+    def proxy_access_line(self):
+        t = self.next_time()
+        client = self.random.choice(self.clients)
+        request_time = self.random.uniform(0.001, 0.5)
+        method = self.random.choice(METHODS)
+        return (
+            f"{self.syslog_header(self.proxy[0], 'proxy-server')} {client} {client} "
+            f"{strftime('%d/%b/%Y/%H/%M/%S', gmtime(t))} {method} "
+            f"/v1/AUTH_test/c{self.random.randrange(100)}/o{self.random.randrange(10000)} HTTP/1.0 "
+            f"{self.random.choice(STATUS_CODES)} - {self.random.choice(CLIENT_AGENTS)} "
+            f"AUTH_tk{self.random.getrandbits(64):016x} {self.random.randrange(1 << 20)} "
+            f"{self.random.randrange(1 << 20)} - {self.next_transaction_id()} - {request_time:.4f} - - "
+            f"{t:.4f} {t + request_time:.4f} 0"
+        )
+
+    def proxy_stderr_line(self):
+        t = self.next_time()
+        if self.random.random() < 0.5:
+            message = f"(eventlet) accepted ('{self.random.choice(self.clients)}', {self.random.randrange(30000, 60000)})"
+        else:
+            message = (
+                f"{self.random.choice(self.clients)} - - [{strftime('%d/%b/%Y %H:%M:%S', gmtime(t))}] "
+                f'"GET /info HTTP/1.1" 200 {self.random.randrange(100, 5000)} "-" "-" '
+                f'"{self.next_transaction_id()}" {self.random.uniform(0.001, 0.1):.6f}'
+            )
+        return f"{self.syslog_header(self.proxy[0], 'proxy-server')} STDERR: {message}"
+
+    def storage_line(self, server):
+        t = self.next_time()
+        host, ip = self.random.choice(self.hosts)
+        method = self.random.choice(METHODS)
+        path = f"/sdb{self.random.randrange(1, 5)}/{self.random.randrange(1024)}/AUTH_test"
+        if server != "account":
+            path += f"/c{self.random.randrange(100)}"
+        if server == "object":
+            path += f"/o{self.random.randrange(10000)}"
+        return (
+            f"{self.syslog_header(host, f'{server}-server')} {self.proxy[1]} - - "
+            f"[{strftime('%d/%b/%Y:%H:%M:%S', gmtime(t))} +0000] \"{method} {path}\" "
+            f"{self.random.choice(STATUS_CODES)} {self.random.randrange(1 << 16)} "
+            f"\"{method} http://{self.proxy[1]}:8080/v1/AUTH_test\" \"{self.next_transaction_id()}\" "
+            f"\"{self.random.choice(BACKEND_AGENTS)} {self.random.randrange(100, 40000)}\" "
+            f"{self.random.uniform(0.0005, 0.2):.4f} \"-\" {self.random.randrange(100, 40000)} 0"
+        )
+
+    def object_line(self):
+        return self.storage_line("object")
+
+    def container_line(self):
+        return self.storage_line("container")
+
+    def account_line(self):
+        return self.storage_line("account")
+
+    def malformed_line(self):
+        kind = self.random.randrange(3)
+        if kind == 0:                                           # truncated line
+            line = self.storage_line("object")
+            return line[:self.random.randrange(len(line))]
+        if kind == 1:                                           # unknown service
+            return f"{self.syslog_header(self.proxy[0], 'kernel')} eth0: link up"
+        return "".join(self.random.choice("abc -:/[]\"0123") for _ in range(self.random.randrange(80)))
+
+    def records(self, count):
+        """ yield (count) log records in the json (syslog forwarder) form """
+        for line in self.lines(count):
+            yield self.to_record(line)
+
+    def to_record(self, line):
+        """ json form of a text line, malformed lines lose their syslog host """
+        tag = line.find("-server: ")
+        if tag == -1 or "STDERR" in line:
+            return {"message": line, "@timestamp": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(self.time))}
+        header = line[:tag].split(" ")
+        items = line[tag + 9:].split(" ")
+        program_name = f"{header[-1]}-server"
+        record = {
+            "@timestamp": strftime("%Y-%m-%dT%H:%M:%SZ", gmtime(self.time)),
+            "sysloghost": header[3] if len(header) > 3 else "-",
+            "program_name": program_name,
+            "tags": ["swift"],
+        }
+        try:
+            if program_name == "proxy-server":
+                record.update({
+                    "remote_addr": items[1], "method": items[3], "path": items[4],
+                    "status_int": int(items[6]), "user_agent": items[8],
+                    "bytes_recvd": int(items[10]), "bytes_sent": int(items[11]),
+                    "transaction_id": items[13], "request_time": items[15],
+                    "headers": ["Host: 172.20.0.2:8080", f"User-Agent: {items[8]}"],
+                })
+            else:
+                record.update({
+                    "remote_addr": items[0], "method": items[5][1:], "path": items[6][:-1],
+                    "status_int": int(items[7]), "user_agent": f"{items[12]} {items[13]}"[1:-1],
+                    "transaction_id": items[11][1:-1], "request_time": items[14],
+                })
+        except (IndexError, ValueError):
+            record.pop("sysloghost")                            # malformed record
+        return record
+
+
+def parse_mix(text):
+    """ 'object=0.5,proxy_access=0.5' -> {"object": 0.5, "proxy_access": 0.5} """
+    mix = {}
+    for item in text.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in DEFAULT_MIX:
+            raise Exception(f"Invalid line kind: {kind}")
+        mix[kind] = float(weight)
+    return mix
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="generate synthetic swift logs")
+    arg_parser.add_argument("output", help="output file (.txt or .json for NDJSON), '-' for stdout")
+    arg_parser.add_argument("--lines", type=int, default=100000)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--hosts", type=int, default=8, help="number of storage nodes")
+    arg_parser.add_argument("--clients", type=int, default=4, help="number of client IPs")
+    arg_parser.add_argument("--mix", type=parse_mix, default=None,
+                            help=f"line kinds and weights, default {','.join(f'{k}={v}' for k, v in DEFAULT_MIX.items())}")
+    arg_parser.add_argument("--json", action="store_true", help="write NDJSON records instead of text lines")
+    args = arg_parser.parse_args()
+
+    generator = SwiftLogGenerator(args.seed, args.mix, args.hosts, args.clients)
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    with out:
+        if args.json or args.output.endswith(".json"):
+            for record in generator.records(args.lines):
+                out.write(json.dumps(record) + "\n")
+        else:
+            for line in generator.lines(args.lines):
+                out.write(line + "\n")
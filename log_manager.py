@@ -1,7 +1,11 @@
+import atexit
+from collections import defaultdict
 from logging import Formatter, Handler, getLogger
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from os import makedirs as os_makedirs
 from os import path as os_path
+from queue import SimpleQueue
+from time import monotonic
 
 from settings import ENV
 
@@ -9,7 +13,7 @@ from settings import ENV
 class LogManager:
     """ defined to handle logging in the program"""
 
-    def __init__(self):
+    def __init__(self, background=ENV.Logger_Background):
         super(LogManager, self).__init__()
 
         self.log_level = ENV.Logger_LogLevel
@@ -19,6 +23,15 @@ class LogManager:
 
         self.handler: Handler = None
         self.formatter: Formatter = None
+        self.background = background                # file writes happen in a QueueListener thread
+        self.listener: QueueListener = None
+
+        self.reject_counts = defaultdict(int)       # rejected lines by reason
+        self.sampled_out = 0                        # rejected lines counted but not written
+        self.sample_threshold = ENV.Logger_SAMPLE_THRESHOLD
+        self.sample_rate = ENV.Logger_SAMPLE_RATE
+        self.window_start = monotonic()             # start of the current one second rate window
+        self.window_rejects = 0
 
         self.setup_logger()
 
@@ -81,8 +94,41 @@ class LogManager:
     def setup_logger(self):                                     # initialize logger object with handler
         self.f_logger = self.init_logger()
         handler = self.init_handler()
+        if self.background:                                     # callers only enqueue, a thread writes the file
+            log_queue = SimpleQueue()
+            self.listener = QueueListener(log_queue, handler)
+            self.listener.start()
+            handler = QueueHandler(log_queue)
+            atexit.register(self.stop)
         self.f_logger.addHandler(handler)
 
+    def stop(self):
+        """ log the reject summary and wait until the background thread wrote everything """
+        if self.reject_counts:
+            counts = ", ".join(f"{reason}={count}" for reason, count in sorted(self.reject_counts.items()))
+            self.f_logger.info(f"rejected lines: {counts} (not written: {self.sampled_out})")
+            self.reject_counts.clear()
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def reject(self, line, reason):
+        """log an unprocessible line once, with its reason code
+
+        above sample_threshold rejects per second only one of sample_rate
+        lines is written, all of them are counted
+        """
+        self.reject_counts[reason] += 1
+        now = monotonic()
+        if now - self.window_start >= 1.0:
+            self.window_start = now
+            self.window_rejects = 0
+        self.window_rejects += 1
+        if self.window_rejects > self.sample_threshold and self.window_rejects % self.sample_rate:
+            self.sampled_out += 1
+            return
+        self.f_logger.error("%s %s", reason, line)
+
     @property
     def file_logger(self):
         """file logger
@@ -0,0 +1,159 @@
+"""
+    this file contains the pipeline metrics (counters, stage timers, progress)
+"""
+import json
+import sys
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from os import replace as os_replace
+from threading import Lock
+from time import monotonic, perf_counter
+
+from settings import ENV
+
+
+def timer(metrics, name):
+    """ time a block into (metrics), no-op if metrics is None """
+    if metrics is None:
+        return nullcontext()
+    return metrics.timer(name)
+
+
+class PipelineMetrics:
+    """
+    counts and times the pipeline stages, prints periodic progress and
+    exports snapshots as json or prometheus textfile
+
+    counters and timers may be updated from writer threads, the updates
+    and the snapshots hold the lock
+    """
+
+    def __init__(self, total_bytes=None, progress_interval=ENV.Metrics_PROGRESS_INTERVAL,
+                 json_file=None, prometheus_file=None, output=sys.stderr) -> None:
+        self.counters = defaultdict(int)            # lines_read, lines_parsed, nodes_created, ...
+        self.rejected = defaultdict(int)            # rejected lines by reason
+        self.timer_seconds = defaultdict(float)     # total seconds per timed stage
+        self.timer_counts = defaultdict(int)        # number of timed calls per stage
+        self.total_bytes = total_bytes              # input size, for the ETA (None if unknown)
+        self.progress_interval = progress_interval  # seconds between progress reports (0 = off)
+        self.json_file = json_file
+        self.prometheus_file = prometheus_file
+        self.output = output
+        self.started = monotonic()
+        self.last_report = self.started
+        self.lock = Lock()
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def reject(self, reason):
+        """ count a rejected (unprocessible) line """
+        with self.lock:
+            self.rejected[reason] += 1
+
+    @contextmanager
+    def timer(self, name):
+        """ time a block as stage (name) """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, perf_counter() - start)
+
+    def add_time(self, name, seconds):
+        """ add one timed call of stage (name) """
+        with self.lock:
+            self.timer_seconds[name] += seconds
+            self.timer_counts[name] += 1
+
+    def track_lines(self, lines):
+        """ count lines (and bytes) read from a line stream, report progress on the way """
+        counters, lock = self.counters, self.lock
+        for line in lines:
+            with lock:
+                counters["lines_read"] += 1
+                if isinstance(line, str):
+                    counters["bytes_read"] += len(line) + 1
+                elif isinstance(line, tuple):                       # (line, parse results) of cached/parallel lines
+                    counters["bytes_read"] += len(line[0]) + 1
+            if not counters["lines_read"] & 1023:
+                self.progress()
+            yield line
+
+    def progress(self, force=False):
+        """ print progress and export the snapshot if progress_interval has passed """
+        now = monotonic()
+        if not force and (not self.progress_interval or now - self.last_report < self.progress_interval):
+            return
+        self.last_report = now
+        elapsed = now - self.started
+        lines = self.counters["lines_read"]
+        report = (
+            f"{lines} lines ({lines / elapsed if elapsed else 0:,.0f}/s), "
+            f"{sum(self.rejected.values())} rejected, "
+            f"{self.counters['nodes_created']} nodes, {self.counters['edges_created']} edges"
+        )
+        read = self.counters["bytes_read"]
+        if self.total_bytes and read:
+            fraction = min(read / self.total_bytes, 1.0)
+            eta = elapsed * (1 - fraction) / fraction
+            report += f", {fraction:.1%} done, ETA {int(eta // 60)}m{int(eta % 60):02d}s"
+        print(report, file=self.output)
+        self.export()
+
+    def snapshot(self):
+        """ current values of all metrics """
+        with self.lock:
+            return {
+                "elapsed_seconds": monotonic() - self.started,
+                "counters": dict(self.counters),
+                "rejected": dict(self.rejected),
+                "timers": {
+                    name: {"seconds": seconds, "count": self.timer_counts[name]}
+                    for name, seconds in self.timer_seconds.items()
+                },
+            }
+
+    def export(self):
+        """ write the configured json / prometheus files """
+        if self.json_file:
+            self.write_atomic(self.json_file, json.dumps(self.snapshot(), indent=2))
+        if self.prometheus_file:
+            self.write_atomic(self.prometheus_file, self.prometheus_text())
+
+    def prometheus_text(self):
+        """ snapshot in the prometheus text exposition format (node exporter textfile) """
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE sarbazi_{name}_total counter")
+            lines.append(f"sarbazi_{name}_total {value}")
+        lines.append("# TYPE sarbazi_rejected_lines_total counter")
+        for reason, value in sorted(snapshot["rejected"].items()):
+            lines.append(f'sarbazi_rejected_lines_total{{reason="{reason}"}} {value}')
+        lines.append("# TYPE sarbazi_stage_seconds_total counter")
+        lines.append("# TYPE sarbazi_stage_calls_total counter")
+        for name, timer in sorted(snapshot["timers"].items()):
+            lines.append(f'sarbazi_stage_seconds_total{{stage="{name}"}} {timer["seconds"]:.6f}')
+            lines.append(f'sarbazi_stage_calls_total{{stage="{name}"}} {timer["count"]}')
+        lines.append("# TYPE sarbazi_elapsed_seconds gauge")
+        lines.append(f"sarbazi_elapsed_seconds {snapshot['elapsed_seconds']:.3f}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def write_atomic(file_name, text):
+        temp_file = f"{file_name}.tmp"
+        with open(temp_file, "w") as f:
+            f.write(text)
+        os_replace(temp_file, file_name)
+
+    def summary(self):
+        """ final report of all stages """
+        self.progress(force=True)
+        snapshot = self.snapshot()
+        for reason, value in sorted(snapshot["rejected"].items()):
+            print(f"  rejected ({reason}): {value}", file=self.output)
+        for name, timer in sorted(snapshot["timers"].items()):
+            seconds, count = timer["seconds"], timer["count"]
+            print(f"  {name}: {seconds:.2f}s in {count} calls ({seconds / count * 1000:.1f} ms avg)", file=self.output)
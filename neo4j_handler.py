@@ -2,13 +2,85 @@
 this file contains handlers for interacting with Neo4j
 """
 from neo4j import GraphDatabase
-from typing import Dict
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
+from re import compile as regex_compile
+from threading import Lock, Thread
+from typing import Callable, Dict, Iterable, List, Optional
+from settings import ENV
+from graph_sink import GraphSink
+from metrics import timer
+from edge_aggregator import WeightedEdge
+from queries import RELATIONSHIP_TYPE, UNTAGGED_RUN_ID, QueryCatalog
 
+RETRYABLE_ERRORS = (TransientError, ServiceUnavailable, SessionExpired)    # deadlocks, leader switches, ...
+NODE_TYPES = ("Server", "Proxy", "ClientIP")                  # typed labels next to :node
+UNSAFE_NAME_CHARACTERS = regex_compile(r"[^A-Za-z0-9_]")
 
-class Neo4jHandler:
+
+def graph_node_name(name: str) -> str:
+    """ node name of a server name or IP, as GraphHandler writes it (m1-r1z1s1 -> m1_r1z1s1) """
+    if "." in name:
+        name = f"IP_{name}".replace(".", "_")
+    return name.replace("-", "_")
+
+
+SERVER_NODES = {                                                # nodes of the servers in ENV.server_names
+    graph_node_name(name) for name in ENV.server_names.values() if not graph_node_name(name).startswith("IP_")
+}
+PROXY_NODES = {graph_node_name(name) for name in ENV.proxy_hosts}
+
+
+def node_type_labels(node: str) -> str:
+    """typed labels of a node, appended to :node
+
+    :return: e.g. ':Server:Proxy', '' if the node has no known type
+    """
+    labels = ""
+    if node in SERVER_NODES or node in PROXY_NODES:
+        labels += ":Server"
+    if node in PROXY_NODES:
+        labels += ":Proxy"
+    if node.startswith("IP_"):
+        labels += ":ClientIP"
+    return labels
+
+
+def edge_properties(edge: Dict) -> Dict:
+    """convert edge info to relationship properties
+
+    list values are skipped; the numbers of aggregated edges (counts,
+    sums) are kept, all values of raw edges are stored as strings
+    (json and txt edges have the same property types)
+    """
+    if isinstance(edge, WeightedEdge):
+        return {
+            key: value if type(value) in (int, float) else f"{value}"
+            for key, value in edge.items()
+            if not isinstance(value, list)
+        }
+    return {key: f"{value}" for key, value in edge.items() if not isinstance(value, list)}
+
+
+def relationship_index_statements(queries: QueryCatalog, labels, indexed_labels, keys) -> List[str]:
+    """index statements of the (keys) properties of the edge labels not in (indexed_labels)
+
+    the labels are added to (indexed_labels), invalid labels are skipped (they fail in the edge batch)
+    """
+    statements = []
+    for label in labels:
+        if label in indexed_labels or not RELATIONSHIP_TYPE.fullmatch(label):
+            continue
+        indexed_labels.add(label)
+        for key in sorted(keys):
+            name = UNSAFE_NAME_CHARACTERS.sub("_", f"rel_{label}_{key}")
+            statements.append(queries.relationship_index(label, key, name))
+    return statements
+
+
+class Neo4jHandler(GraphSink):
     """neo4j handler
 
-    this class handles neo4j operations
+    this class handles neo4j operations (the Neo4j graph sink)
     """
 
     graphDB_Driver = None
@@ -25,6 +97,58 @@ class Neo4jHandler:
                 password
             )
         )
+        self.batch_size = int(config.get("batch_size", ENV.Neo4j_BATCH_SIZE))
+        self.node_buffer = []           # node names waiting for the next bulk write
+        self.edge_buffer = []           # (node_1, node_2, edge) waiting for the next bulk write
+        self.batch_count = 0            # number of bulk write batches sent so far
+        self.failed_batches = []        # reports of batches which could not be written
+        self.lock = Lock()              # batch_count and failed_batches are shared with writer threads
+        self.run_id = config.get("run_id")      # tag of the nodes/edges of this ingestion run (None = untagged)
+        self.delete_batch_size = int(config.get("delete_batch_size", ENV.Neo4j_DELETE_BATCH_SIZE))
+        self.transaction_constraint = False     # the :Transaction uniqueness constraint exists
+        self.relationship_indexes = set(config.get("relationship_indexes", ENV.Neo4j_RELATIONSHIP_INDEXES))
+        self.indexed_labels = set()             # edge labels whose property indexes exist
+        self.queries = QueryCatalog(run_scoped=self.run_id is not None)
+        if config.get("ensure_schema", ENV.Neo4j_ENSURE_SCHEMA):
+            self.ensure_schema()
+
+    def key_run_id(self) -> str:
+        """ run_id of the node and transaction keys of this handler """
+        return UNTAGGED_RUN_ID if self.run_id is None else self.run_id
+
+    def ensure_schema(self) -> None:
+        """create the node key constraint and the typed label indexes (if they do not exist)
+
+        the MATCH of every edge write is an index seek instead of a scan of
+        all nodes; tagged runs (run_id) share node names, so the one node key
+        of all runs is (name, run_id), untagged nodes have run_id
+        UNTAGGED_RUN_ID (neo4j does not check a key with a null); a
+        name-only constraint would reject the nodes of a second run and is
+        dropped
+        """
+        statements = [
+            "DROP CONSTRAINT node_name IF EXISTS",
+            "CREATE CONSTRAINT node_name_run_id IF NOT EXISTS "
+            + "FOR (n:node) REQUIRE (n.name, n.run_id) IS UNIQUE",
+            "CREATE INDEX node_run_id IF NOT EXISTS FOR (n:node) ON (n.run_id)",
+        ]
+        for node_type in NODE_TYPES:
+            statements.append(
+                f"CREATE INDEX {node_type.lower()}_name IF NOT EXISTS FOR (n:{node_type}) ON (n.name)"
+            )
+        with self.graphDB_Driver.session() as graphDB_Session:
+            for statement in statements:
+                graphDB_Session.run(statement).consume()
+
+    def ensure_relationship_indexes(self, labels) -> None:
+        """ index the relationship_indexes properties of edge labels not indexed yet """
+        statements = relationship_index_statements(
+            self.queries, labels, self.indexed_labels, self.relationship_indexes)
+        if not statements:
+            return
+        with self.graphDB_Driver.session() as graphDB_Session:
+            for statement in statements:
+                graphDB_Session.run(statement).consume()
 
     def create_new_node(self, node: str) -> str:
         """create new node named (node)
@@ -32,18 +156,32 @@ class Neo4jHandler:
         :param node: node name
         :return: node creation query
         """
-        create_node = (
-            "CREATE \n" 
-            + f"({node}:node " 
-            + "{ name: " 
-            + f'"{node}"' 
-            + "})"
-        )
-        with self.graphDB_Driver.session() as graphDB_Session:
-            graphDB_Session.run(create_node)
+        create_node = self.queries.create_node(node_type_labels(node))
+        with timer(self.metrics, "neo4j_wait"), self.graphDB_Driver.session() as graphDB_Session:
+            graphDB_Session.run(create_node, name=node, run_id=self.run_id)
 
         return create_node
 
+    def merge_new_node(self, node: str) -> str:
+        """create node named (node) if it does not exist yet (idempotent)
+
+        :param node: node name
+        :return: node merge query
+        """
+        merge_node = self.queries.merge_node(node_type_labels(node))
+        with timer(self.metrics, "neo4j_wait"), self.graphDB_Driver.session() as graphDB_Session:
+            graphDB_Session.run(merge_node, name=node, run_id=self.run_id)
+
+        return merge_node
+
+    def get_node_names(self) -> set:
+        """ get names of all nodes in the graph """
+        with self.graphDB_Driver.session() as graphDB_Session:
+            result = graphDB_Session.run(
+                "MATCH (n:node {run_id: $run_id}) RETURN n.name AS name", run_id=self.key_run_id()
+            )
+            return {record["name"] for record in result}
+
     def create_new_edge(self, node_1: str, node_2: str, edge: Dict) -> str:
         """create new edge from node_1 to node_2
 
@@ -52,37 +190,234 @@ class Neo4jHandler:
         :param edge: edge properties
         :return: edge creation query
         """
-        string = ""
-
-        for i, key in enumerate(edge.keys()):
-            if isinstance(edge[key], list):
-                continue
-            string += f"{key}: " + f"'{edge[key]}', "
-
-        string = string[0:-2]  # to avoid the final ', ' in the string
-
-        create_edge = (
-            "MATCH (u:node {name:"
-            + f"'{node_1}'"
-            + "}), (r: node {name: "
-            + f"'{node_2}'"
-            + "}) "
-            + f"CREATE(u)-[:{edge['label']}"
-            + " { "
-            + string
-            + " }]->(r)"
+        create_edge = self.queries.create_edge(edge["label"])
+        with timer(self.metrics, "neo4j_wait"), self.graphDB_Driver.session() as graphDB_Session:
+            graphDB_Session.run(
+                create_edge, source=node_1, target=node_2, properties=edge_properties(edge), run_id=self.run_id
+            )
+
+        return create_edge
+
+    def clear_graph(self, progress: Optional[Callable] = None) -> int:
+        """clear the graph in chunks of delete_batch_size (one transaction per chunk)
+
+        relationships are deleted before the nodes, so no transaction has to
+        hold all relationships of a hub node
+        :param progress: called with (kind, deleted so far) after each chunk, prints by default
+        :return: number of deleted nodes and relationships
+        """
+        cqldelete1 = "match (a) -[r] -> () with r limit $limit delete r return count(r) as deleted"
+        cqldelete2 = "match (a) with a limit $limit delete a return count(a) as deleted"
+        return (
+            self.delete_in_batches(cqldelete1, "relationships", progress)
+            + self.delete_in_batches(cqldelete2, "nodes", progress)
         )
 
+    def delete_in_batches(self, query: str, kind: str, progress: Optional[Callable] = None, **parameters) -> int:
+        """run a delete query returning (deleted) until nothing is left
+
+        :param query: delete query limited to $limit items
+        :param kind: name of the deleted items for the progress report
+        :return: number of deleted items
+        """
+        if progress is None:
+            progress = lambda _kind, _deleted: print(f"deleted {_deleted} {_kind}")
+
+        def delete(tx):
+            return tx.run(query, limit=self.delete_batch_size, **parameters).single()["deleted"]
+
+        total = 0
+        while True:
+            with self.graphDB_Driver.session() as graphDB_Session:
+                deleted = graphDB_Session.execute_write(delete)
+            if not deleted:
+                return total
+            total += deleted
+            progress(kind, total)
+
+    def activate_run(self) -> Optional[str]:
+        """make run_id the active graph in one transaction, readers follow (:ActiveRun).run_id
+
+        :return: run id of the previously active graph
+        """
+        activate = (
+            "MERGE (a:ActiveRun {graph: 'default'}) "
+            + "WITH a, a.run_id AS previous "
+            + "SET a.run_id = $run_id "
+            + "RETURN previous"
+        )
         with self.graphDB_Driver.session() as graphDB_Session:
-            graphDB_Session.run(create_edge)
+            return graphDB_Session.execute_write(
+                lambda tx: tx.run(activate, run_id=self.run_id).single()["previous"]
+            )
 
-        return create_edge
+    def drop_run(self, run_id: str, progress: Optional[Callable] = None) -> int:
+        """delete nodes and edges of (run_id) in chunks
+
+        :return: number of deleted nodes and relationships
+        """
+        drop_edges = (
+            "match (a:node {run_id: $run_id}) -[r] -> () "
+            + "with r limit $limit delete r return count(r) as deleted"
+        )
+        drop_nodes = "match (a:node {run_id: $run_id}) with a limit $limit delete a return count(a) as deleted"
+        drop_transactions = (
+            "match (t:Transaction {run_id: $run_id}) with t limit $limit delete t return count(t) as deleted"
+        )
+        return (
+            self.delete_in_batches(drop_edges, f"relationships of run {run_id}", progress, run_id=run_id)
+            + self.delete_in_batches(drop_nodes, f"nodes of run {run_id}", progress, run_id=run_id)
+            + self.delete_in_batches(drop_transactions, f"transactions of run {run_id}", progress, run_id=run_id)
+        )
+
+    def drop_run_in_background(self, run_id: str) -> Thread:
+        """ start dropping (run_id) in a background thread """
+        thread = Thread(target=self.drop_run, args=(run_id,), name=f"drop-run-{run_id}")
+        thread.start()
+        return thread
+
+    def queue_node(self, node: str) -> None:
+        """add node to the bulk write buffer, write the buffer when it is full
+
+        :param node: node name
+        """
+        self.node_buffer.append(node)
+        if len(self.node_buffer) >= self.batch_size:
+            self.flush_nodes()
+
+    def queue_edge(self, node_1: str, node_2: str, edge: Dict) -> None:
+        """add edge to the bulk write buffer, write the buffer when it is full
+
+        :param node_1: source node
+        :param node_2: destination node
+        :param edge: edge properties
+        """
+        self.edge_buffer.append((node_1, node_2, edge))
+        if len(self.edge_buffer) >= self.batch_size:
+            self.flush_nodes()                                  # failures are kept for the next flush()
+            self.flush_edges()
 
-    def clear_graph(self) -> None:
-        """ clear the graph"""
+    def flush(self) -> List[Dict]:
+        """write all buffered nodes and edges (nodes first, so edges can match them)
 
-        cqldelete1 = "match (a) -[r] -> () delete a, r"
-        cqldelete2 = "match (a) delete a"
+        :return: reports of the batches failed since the last flush
+        """
+        self.flush_nodes()
+        self.flush_edges()
+        failed_batches, self.failed_batches = self.failed_batches, []
+        return failed_batches
+
+    def flush_nodes(self) -> None:
+        """write buffered nodes in one transaction"""
+        if not self.node_buffer:
+            return
+        rows, self.node_buffer = self.node_buffer, []
+        types = {}                                              # typed labels -> node names
+        for node in rows:
+            types.setdefault(node_type_labels(node), []).append(node)
+
+        def write(tx):
+            for labels, names in types.items():
+                tx.run(self.queries.create_nodes(labels), rows=names, run_id=self.run_id).consume()
+
+        self.write_batch("nodes", len(rows), write)
+
+    def flush_edges(self) -> None:
+        """write buffered edges in one transaction, one UNWIND query per edge label"""
+        if not self.edge_buffer:
+            return
+        rows, self.edge_buffer = self.edge_buffer, []
+        if self.relationship_indexes:
+            self.ensure_relationship_indexes({edge["label"] for node_1, node_2, edge in rows})
+        self.write_batch("edges", len(rows), self.edge_writer(rows))
+
+    def edge_writer(self, rows: List) -> Callable:
+        """transaction function creating the (node_1, node_2, edge) rows, one UNWIND query per edge label
+
+        rows are sorted by their nodes within each label, which keeps lock waits between concurrent
+        transactions short; the labels are written one after the other, so there is no common lock
+        order across labels and deadlocks are left to the retries of the caller
+        """
+        labels = {}
+        for node_1, node_2, edge in sorted(rows, key=lambda row: (row[0], row[1])):
+            labels.setdefault(edge["label"], []).append(
+                {"source": node_1, "target": node_2, "properties": edge_properties(edge)}
+            )
+
+        def write(tx):
+            for label, label_rows in labels.items():
+                tx.run(self.queries.create_edges(label), rows=label_rows, run_id=self.run_id).consume()
+
+        return write
+
+    def create_transaction_constraint(self) -> None:
+        """ make :Transaction nodes unique by (transaction_id, run_id), like the nodes (see ensure_schema) """
+        statements = [
+            "DROP CONSTRAINT transaction_id IF EXISTS",
+            "CREATE CONSTRAINT transaction_id_run_id IF NOT EXISTS "
+            + "FOR (t:Transaction) REQUIRE (t.transaction_id, t.run_id) IS UNIQUE",
+        ]
         with self.graphDB_Driver.session() as graphDB_Session:
-            graphDB_Session.run(cqldelete1)
-            graphDB_Session.run(cqldelete2)
+            for statement in statements:
+                graphDB_Session.run(statement).consume()
+        self.transaction_constraint = True
+
+    def write_transactions(self, transactions: Iterable[Dict]) -> None:
+        """write transaction summaries (TransactionIndex.drain) as :Transaction nodes
+
+        hops of a transaction already in the graph (an earlier flush) are
+        appended to its hop lists, start/end/latency are updated
+        """
+        if not self.transaction_constraint:
+            self.create_transaction_constraint()
+        key = "{transaction_id: row.transaction_id, run_id: $run_id}"
+        merge_transactions = (
+            "UNWIND $rows AS row "
+            + f"MERGE (t:Transaction {key}) "
+            + "SET t.hop_sources = coalesce(t.hop_sources, []) + row.hop_sources, "
+            + "t.hop_destinations = coalesce(t.hop_destinations, []) + row.hop_destinations, "
+            + "t.hop_labels = coalesce(t.hop_labels, []) + row.hop_labels, "
+            + "t.hop_times = coalesce(t.hop_times, []) + row.hop_times, "
+            + "t.hop_request_times = coalesce(t.hop_request_times, []) + row.hop_request_times, "
+            + "t.hop_status = coalesce(t.hop_status, []) + row.hop_status, "
+            + "t.hop_count = coalesce(t.hop_count, 0) + row.hop_count, "
+            + "t.start = CASE WHEN t.start IS NULL OR row.start < t.start THEN row.start ELSE t.start END, "
+            + "t.end = CASE WHEN t.end IS NULL OR row.end > t.end THEN row.end ELSE t.end END "
+            + "SET t.latency = t.end - t.start"
+        )
+        rows = []
+        for summary in transactions:
+            rows.append(summary)
+            if len(rows) >= self.batch_size:
+                self.write_transaction_rows(merge_transactions, rows)
+                rows = []
+        if rows:
+            self.write_transaction_rows(merge_transactions, rows)
+
+    def write_transaction_rows(self, query: str, rows: List[Dict]) -> None:
+        """ write one batch of transaction summaries """
+
+        def write(tx):
+            tx.run(query, rows=rows, run_id=self.key_run_id()).consume()
+
+        self.write_batch("transactions", len(rows), write)
+
+    def write_batch(self, kind: str, size: int, write) -> None:
+        """run one bulk write transaction, record a report if it fails
+
+        :param kind: nodes or edges
+        :param size: number of rows in the batch
+        :param write: transaction function
+        """
+        with self.lock:
+            self.batch_count += 1
+            batch_number = self.batch_count
+        try:
+            with timer(self.metrics, "neo4j_wait"), timer(self.metrics, f"batch_flush_{kind}"):
+                with self.graphDB_Driver.session() as graphDB_Session:
+                    graphDB_Session.execute_write(write)
+        except Exception as e:
+            with self.lock:
+                self.failed_batches.append(
+                    {"batch": batch_number, "kind": kind, "size": size, "error": f"{e}"}
+                )
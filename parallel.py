@@ -0,0 +1,99 @@
+"""
+    this file contains the multi-process log parsing pipeline
+"""
+from collections import deque
+from itertools import islice
+from multiprocessing import Pool
+
+from input_reader import byte_ranges, map_file, range_lines
+from log_filter import LogFilter
+
+
+worker_graph_handler = None     # graph handler of the worker process (extraction only, no database)
+keep_fields = False             # return the parsed fields too (for the parse cache)
+worker_files = {}               # file name -> memory map of the file in the worker process
+
+
+def init_worker(compact=False, keep=False):
+    """ initialize the graph handler of a worker process """
+    global worker_graph_handler, keep_fields
+    from graph_handler import GraphHandler                         # imported here to avoid a circular import
+
+    worker_graph_handler = GraphHandler(None, LogFilter(), None, compact=compact)  # rejects are logged by the writer process
+    keep_fields = keep
+
+
+def parse_chunk(lines):
+    """
+    extract node and edge info from a chunk of log lines (runs in the workers)
+
+    :return: [(line, (node_1, node_2, edge), reject reason, (layout, values) or None), ...]
+    """
+    handler = worker_graph_handler
+    extract = handler.extract_node_edge_from_log
+    if keep_fields:
+        return [(line, extract(line), handler.reject_reason, handler.fields) for line in lines]
+    return [(line, extract(line), handler.reject_reason, None) for line in lines]
+
+
+def parse_range(file_name, start, end):
+    """
+    extract node and edge info from the lines of a byte range of (file_name) (runs in the workers),
+    the file is memory-mapped once per worker so only the range bounds are sent to it
+
+    :return: like parse_chunk
+    """
+    mapped = worker_files.get(file_name)
+    if mapped is None:
+        mapped = worker_files[file_name] = map_file(file_name)
+    return parse_chunk(range_lines(mapped, start, end))
+
+
+def chunked(lines, chunk_size):
+    """ split the line stream into lists of (chunk_size) lines """
+    lines = iter(lines)
+    while True:
+        chunk = list(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def parse_in_parallel(lines, workers, chunk_size, compact=False, keep_fields=False):
+    """
+    parse lines in a process pool, yield (line, result, reject reason, fields) in the original order
+
+    at most 2 chunks per worker are in flight, so memory stays bounded
+    and the writer gets results as soon as the first chunk is parsed
+    """
+    max_pending = 2 * workers
+    pending = deque()
+    with Pool(workers, initializer=init_worker, initargs=(compact, keep_fields)) as pool:
+        for chunk in chunked(lines, chunk_size):
+            pending.append(pool.apply_async(parse_chunk, (chunk,)))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+def parse_file_in_parallel(file_name, workers, range_size, compact=False, keep_fields=False):
+    """
+    parse a memory-mapped file in a process pool, every task is a newline
+    aligned byte range; yield (line, result, reject reason, fields) in the file order
+
+    this process only looks for the new lines at the range bounds, it does
+    not read or copy the lines itself
+    """
+    mapped = map_file(file_name)
+    if mapped is None:
+        return
+    max_pending = 2 * workers
+    pending = deque()
+    with mapped, Pool(workers, initializer=init_worker, initargs=(compact, keep_fields)) as pool:
+        for start, end in byte_ranges(mapped, range_size):
+            pending.append(pool.apply_async(parse_range, (file_name, start, end)))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
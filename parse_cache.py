@@ -0,0 +1,138 @@
+"""
+    this file contains the on-disk cache of parsed log lines
+"""
+import marshal
+import struct
+import zlib
+from hashlib import sha1
+from os import makedirs as os_makedirs
+from os import path as os_path
+from os import replace as os_replace
+from os import stat as os_stat
+
+from log_filter import PARSER_VERSION
+from parsed_record import RecordLayout
+from settings import ENV
+
+CACHE_MAGIC = b"SARBAZI-PARSE-CACHE\n"
+CHUNK_HEADER = struct.Struct(">I")      # compressed size of the following chunk
+
+
+class ParseCache:
+    """
+    parsed fields of log files, one cache file per log file
+
+    a cache file is valid while the log file has the same path, size and
+    mtime and the parser has the same PARSER_VERSION; it holds zlib
+    compressed marshal chunks of columns (layouts, lines, layout of each
+    line, field values of each line), so reading it skips parsing entirely
+    """
+
+    def __init__(self, cache_dir=ENV.Parse_CACHE_DIR, chunk_size=ENV.Parse_CACHE_CHUNK_SIZE) -> None:
+        self.cache_dir = cache_dir
+        self.chunk_size = chunk_size        # lines per compressed chunk
+
+    def cache_file(self, file_name) -> str:
+        """ path of the cache file of (file_name) """
+        digest = sha1(os_path.abspath(file_name).encode()).hexdigest()
+        return os_path.join(self.cache_dir, f"{digest}.cache")
+
+    @staticmethod
+    def key(file_name):
+        """ identity of the parsed content: (path, size, mtime, parser version) """
+        stat = os_stat(file_name)
+        return os_path.abspath(file_name), stat.st_size, stat.st_mtime_ns, PARSER_VERSION
+
+    def read(self, file_name):
+        """
+        :return: generator of (line, (layout, values) or None) of the cached
+                 file, None if there is no valid cache of (file_name)
+        """
+        cache_file = self.cache_file(file_name)
+        try:
+            f = open(cache_file, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            valid = f.read(len(CACHE_MAGIC)) == CACHE_MAGIC and marshal.load(f) == self.key(file_name)
+        except (EOFError, ValueError, TypeError):
+            valid = False
+        if not valid:
+            f.close()
+            return None
+        return self.read_chunks(f)
+
+    @staticmethod
+    def read_chunks(f):
+        """ yield (line, fields) from the chunks of an open cache file """
+        with f:
+            while True:
+                header = f.read(CHUNK_HEADER.size)
+                if not header:
+                    return
+                size, = CHUNK_HEADER.unpack(header)
+                names, lines, layout_ids, values = marshal.loads(zlib.decompress(f.read(size)))
+                layouts = [RecordLayout.get(_names) for _names in names]
+                for line, layout_id, _values in zip(lines, layout_ids, values):
+                    if layout_id == -1:
+                        yield line, None                        # not parsable, rejected again
+                    else:
+                        yield line, (layouts[layout_id], _values)
+
+    def writer(self, file_name) -> "ParseCacheWriter":
+        """ start a new cache of (file_name), it replaces the old one when it is closed """
+        os_makedirs(self.cache_dir, exist_ok=True)
+        return ParseCacheWriter(self.cache_file(file_name), self.key(file_name), self.chunk_size)
+
+
+class ParseCacheWriter:
+    """
+    writes the parsed lines of one log file to a temporary cache file
+    """
+
+    def __init__(self, cache_file, key, chunk_size) -> None:
+        self.cache_file = cache_file
+        self.temp_file = f"{cache_file}.tmp"
+        self.chunk_size = chunk_size
+        self.f = open(self.temp_file, "wb")
+        self.f.write(CACHE_MAGIC)
+        marshal.dump(key, self.f)
+        self.layout_ids = {}        # layout -> position in the layout column of the chunk
+        self.lines = []
+        self.line_layouts = []
+        self.values = []
+
+    def add(self, line, fields) -> None:
+        """ add a line and its parsed (layout, values), None if it is not parsable """
+        self.lines.append(line)
+        if fields is None:
+            self.line_layouts.append(-1)
+            self.values.append(None)
+        else:
+            layout, values = fields
+            layout_id = self.layout_ids.get(layout)
+            if layout_id is None:
+                layout_id = self.layout_ids[layout] = len(self.layout_ids)
+            self.line_layouts.append(layout_id)
+            self.values.append(tuple(values))
+        if len(self.lines) >= self.chunk_size:
+            self.write_chunk()
+
+    def write_chunk(self) -> None:
+        """ compress and write the collected lines """
+        if not self.lines:
+            return
+        names = [layout.names for layout in self.layout_ids]
+        chunk = zlib.compress(marshal.dumps((names, self.lines, self.line_layouts, self.values)), 1)
+        self.f.write(CHUNK_HEADER.pack(len(chunk)))
+        self.f.write(chunk)
+        self.layout_ids = {}
+        self.lines = []
+        self.line_layouts = []
+        self.values = []
+
+    def close(self) -> None:
+        """ finish the cache file and make it the valid cache """
+        self.write_chunk()
+        self.f.close()
+        os_replace(self.temp_file, self.cache_file)
@@ -0,0 +1,128 @@
+"""
+    this file contains the compact representation of parsed log lines
+"""
+from sys import intern
+from typing import Dict, Tuple
+
+LOW_CARDINALITY_FIELDS = frozenset({    # values repeated on most lines, one shared string each
+    "destination_server", "program_name", "programname", "sysloghost", "host",
+    "method", "protocol", "status_int", "policy_index", "source_service",
+    "remote_addr", "client_ip", "label", "type", "user_agent", "user_agent_id",
+})
+
+
+class RecordLayout:
+    """
+    field names of one log format, shared by all records of the format
+    """
+
+    __slots__ = ("names", "index", "interned")
+    layouts: Dict[Tuple[str, ...], "RecordLayout"] = {}     # all layouts by field names
+
+    def __init__(self, names: Tuple[str, ...]) -> None:
+        self.names = names                                  # field names in value order
+        self.index = {name: i for i, name in enumerate(names)}     # field name -> value position
+        self.interned = tuple(i for i, name in enumerate(names) if name in LOW_CARDINALITY_FIELDS)
+
+    @classmethod
+    def get(cls, names) -> "RecordLayout":
+        """ the layout of (names), created on the first use """
+        names = tuple(names)
+        layout = cls.layouts.get(names)
+        if layout is None:
+            layout = cls.layouts[names] = cls(names)
+        return layout
+
+    def record(self, values) -> "ParsedRecord":
+        """ make a record of this layout, the low cardinality values are interned """
+        values = list(values)
+        for i in self.interned:
+            value = values[i]
+            if type(value) is str:
+                values[i] = intern(value)
+        return ParsedRecord(self, values)
+
+    def __reduce__(self):
+        return RecordLayout.get, (self.names,)              # unpickled records share the layout of the process
+
+    def __repr__(self) -> str:
+        return f"RecordLayout{self.names}"
+
+
+class ParsedRecord:
+    """
+    parsed log line, a list of values and a shared layout instead of a dict
+
+    it behaves like a read/write dict for the graph handler and the sinks,
+    keys which are not in the layout are kept in a small dict of their own
+    """
+
+    __slots__ = ("layout", "values", "extra")
+
+    def __init__(self, layout: RecordLayout, values: list) -> None:
+        self.layout = layout
+        self.values = values
+        self.extra = None               # fields added after parsing (label, type, ...)
+
+    @classmethod
+    def from_dict(cls, fields: Dict) -> "ParsedRecord":
+        """ compact version of a dict record """
+        return RecordLayout.get(fields).record(fields.values())
+
+    def __getitem__(self, key):
+        i = self.layout.index.get(key)
+        if i is not None:
+            return self.values[i]
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value) -> None:
+        i = self.layout.index.get(key)
+        if i is not None:
+            self.values[i] = value
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __contains__(self, key) -> bool:
+        return key in self.layout.index or (self.extra is not None and key in self.extra)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self) -> int:
+        return len(self.values) + (len(self.extra) if self.extra is not None else 0)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (ParsedRecord, dict)):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ParsedRecord({self.to_dict()})"
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        if self.extra is None:
+            return self.layout.names
+        return self.layout.names + tuple(self.extra)
+
+    def items(self):
+        items = list(zip(self.layout.names, self.values))
+        if self.extra is not None:
+            items.extend(self.extra.items())
+        return items
+
+    def to_dict(self) -> Dict:
+        """ plain dict of the record (for the sinks) """
+        fields = dict(zip(self.layout.names, self.values))
+        if self.extra is not None:
+            fields.update(self.extra)
+        return fields
@@ -0,0 +1,121 @@
+"""
+    this file contains the catalog of parameterized cypher queries
+"""
+from re import compile as regex_compile
+from typing import Dict
+
+RELATIONSHIP_TYPE = regex_compile(r"[A-Za-z0-9_\-.]+")         # edge labels written to the graph
+NODE_LABELS = regex_compile(r"(:[A-Za-z_][A-Za-z0-9_]*)*")     # typed labels, e.g. ':Server:Proxy'
+UNTAGGED_RUN_ID = "-"                   # run_id of the nodes of untagged runs (a key with a null is not unique)
+
+
+def relationship_type(label: str) -> str:
+    """backticked relationship type of an edge label
+
+    relationship types can not be parameters, so they are the only value
+    put into a query text and they are checked before
+    :raise ValueError: if (label) is not a valid edge label
+    """
+    if not RELATIONSHIP_TYPE.fullmatch(label):
+        raise ValueError(f"invalid relationship type: {label!r}")
+    return f"`{label}`"
+
+
+def node_labels(labels: str) -> str:
+    """ checked typed node labels (see neo4j_handler.node_type_labels) """
+    if not NODE_LABELS.fullmatch(labels):
+        raise ValueError(f"invalid node labels: {labels!r}")
+    return labels
+
+
+class QueryCatalog:
+    """
+    cypher templates of one sink, all values are parameters
+
+    there is one template per relationship type (and per typed node
+    labels), so neo4j plans each of them once and reuses the plan for every
+    batch; the templates are built on their first use and kept
+    """
+
+    def __init__(self, run_scoped: bool = False) -> None:
+        self.run_scoped = run_scoped        # nodes/edges are tagged with $run_id
+        self.templates: Dict[tuple, str] = {}
+
+    def template(self, name: str, argument: str, build) -> str:
+        """ the (name, argument) template, built by build(argument) on the first use """
+        key = (name, argument)
+        query = self.templates.get(key)
+        if query is None:
+            query = self.templates[key] = build(argument)
+        return query
+
+    def node_key(self, name: str) -> str:
+        """cypher map identifying a node by (name, run_id), untagged nodes have run_id UNTAGGED_RUN_ID
+
+        :param name: cypher expression of the node name
+        """
+        if not self.run_scoped:
+            return "{name: " + name + f", run_id: '{UNTAGGED_RUN_ID}'" + "}"
+        return "{name: " + name + ", run_id: $run_id}"
+
+    def set_run_id(self, variable: str) -> str:
+        """ SET item tagging (variable) with the run, '' if the catalog is not run scoped """
+        return f", {variable}.run_id = $run_id" if self.run_scoped else ""
+
+    def create_node(self, labels: str = "") -> str:
+        """ create one node: $name (, $run_id) """
+        return self.template(
+            "create_node", labels,
+            lambda _labels: f"CREATE (n:node{node_labels(_labels)} {self.node_key('$name')})",
+        )
+
+    def merge_node(self, labels: str = "") -> str:
+        """ create one node if it does not exist yet: $name (, $run_id) """
+        return self.template(
+            "merge_node", labels,
+            lambda _labels: f"MERGE (n:node {self.node_key('$name')})"
+            + (f" SET n{node_labels(_labels)}" if _labels else ""),
+        )
+
+    def create_nodes(self, labels: str = "") -> str:
+        """ create a batch of nodes: $rows (node names) (, $run_id) """
+        return self.template(
+            "create_nodes", labels,
+            lambda _labels: f"UNWIND $rows AS name CREATE (:node{node_labels(_labels)} {self.node_key('name')})",
+        )
+
+    def create_edge(self, label: str) -> str:
+        """ create one edge: $source, $target, $properties (, $run_id) """
+        return self.template(
+            "create_edge", label,
+            lambda _label: f"MATCH (u:node {self.node_key('$source')}), (r:node {self.node_key('$target')}) "
+            + f"CREATE (u)-[e:{relationship_type(_label)}]->(r) "
+            + "SET e = $properties"
+            + self.set_run_id("e"),
+        )
+
+    def create_edges(self, label: str) -> str:
+        """ create a batch of edges between existing nodes: $rows of {source, target, properties} (, $run_id) """
+        return self.template(
+            "create_edges", label,
+            lambda _label: "UNWIND $rows AS row "
+            + f"MATCH (u:node {self.node_key('row.source')}), (r:node {self.node_key('row.target')}) "
+            + f"CREATE (u)-[e:{relationship_type(_label)}]->(r) "
+            + "SET e = row.properties"
+            + self.set_run_id("e"),
+        )
+
+    def merge_nodes(self, labels: str = "") -> str:
+        """ create a batch of nodes if they do not exist yet: $rows (node names) (, $run_id) """
+        return self.template(
+            "merge_nodes", labels,
+            lambda _labels: f"UNWIND $rows AS name MERGE (n:node {self.node_key('name')})"
+            + (f" SET n{node_labels(_labels)}" if _labels else ""),
+        )
+
+    def relationship_index(self, label: str, key: str, name: str) -> str:
+        """ index (name) on the (key) property of the edges of (label) """
+        return (
+            f"CREATE INDEX {name} IF NOT EXISTS "
+            + f"FOR ()-[e:{relationship_type(label)}]-() ON (e.{key})"
+        )
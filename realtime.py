@@ -3,119 +3,341 @@ from neo4j import GraphDatabase
 from typing import Dict
 from log_filter import LogFilter
 from graph_handler import GraphHandler
-from neo4j_handler import Neo4jHandler
+from neo4j_handler import RETRYABLE_ERRORS, Neo4jHandler
 from settings import ENV
 from json import loads
+from async_ingest import ingest_records
+from metrics import PipelineMetrics
+from dedup import Deduplicator
+from threading import Thread
+import argparse
+import asyncio
+import random
 import sys
 
+STOP = None         # end of input marker in the daemon queue
+
+
+def parse_message(data):
+    """ parse one NDJSON / syslog message into {"log": {...}}, None if it is not json """
+    if isinstance(data, bytes):
+        data = data.decode("utf-8", errors="replace")
+    start = data.find("{")                          # skip syslog header (<PRI>timestamp host tag:)
+    if start == -1:
+        return None
+    try:
+        message = loads(data[start:])
+    except ValueError:
+        return None
+    if not isinstance(message, dict):
+        return None
+    if "log" not in message:                        # bare log record
+        message = {"log": message}
+    return message
+
 
 class RealTimeDrawer:
 
     graphDB_Driver = None
 
-    def __init__(self, config: Dict, logger) -> None:
-        """ initialize neo4j graphDB driver with given config"""
+    def __init__(self, config: Dict, logger, sink=None) -> None:
+        """ initialize neo4j graphDB driver with given config (or write to the given graph sink)"""
         self.parser = LogFilter()
         self.logger = logger
-        self.neo = Neo4jHandler(config)
+        self.neo = sink if sink is not None else Neo4jHandler(config)
         self.graph = GraphHandler(self.neo, self. parser, self.logger)
+        self.node_names = set()             # local cache of the node names present in the graph
+        self.refresh_node_cache()
+
+    def refresh_node_cache(self):
+        """ load node names from the graph (once at startup, or after the graph changed elsewhere) """
+        self.node_names = self.neo.get_node_names()
 
     def draw(self, message: Dict):
         """ send request to neo4j server """
         # message = eval(message)
         result = self.graph.extract_node_edge_from_json(message["log"])
+        if not self.graph.is_processible(message["log"], result, self.graph.reject_reason):
+            return
         # node_1 = ""
         # node_2 = ""
         # edge = {}
         node_1, node_2, edge = result
         node_1, node_2 = self.preprocess_node_names([node_1, node_2])
-        with self.neo.graphDB_Driver.session() as graphDB_Session:
-            nodes = graphDB_Session.run("MATCH (n:node) RETURN n ")
-            node_names = [n[0]._properties['name'] for n in nodes]
-            print("here")
 
-            if node_1 not in node_names:
-                self.neo.create_new_node(node_1)
-            if node_2 not in node_names:
-                self.neo.create_new_node(node_2)
+        if node_1 not in self.node_names:                           # only unseen nodes go to the database
+            self.neo.merge_new_node(node_1)
+            self.node_names.add(node_1)
+        if node_2 not in self.node_names:
+            self.neo.merge_new_node(node_2)
+            self.node_names.add(node_2)
+
+        self.neo.create_new_edge(node_1, node_2, edge)
+
+    def records(self, messages):
+        """ yield (node_1, node_2, edge) of the processible messages """
+        for message in messages:
+            result = self.graph.extract_node_edge_from_json(message["log"])
+            if not self.graph.is_processible(message["log"], result, self.graph.reject_reason):
+                continue
+            node_1, node_2, edge = result
+            node_1, node_2 = self.preprocess_node_names([node_1, node_2])
+            if self.graph.is_duplicate(node_1, node_2, edge):
+                continue
+            yield node_1, node_2, edge
+
+    def draw_batch(self, messages):
+        """ send a batch of messages to neo4j server in one bulk write """
+        return self.write_records(list(self.records(messages)))
+
+    def write_records(self, records):
+        """write (node_1, node_2, edge) records in one bulk write
 
-            self.neo.create_new_edge(node_1, node_2, edge)
+        all nodes are merged before the first edge is queued, so a batch
+        which failed on a node can be written again without duplicate edges
+        """
+        metrics = self.graph.metrics
+        for node_1, node_2, edge in records:
+            for node in (node_1, node_2):
+                if node not in self.node_names:                     # only unseen nodes go to the database
+                    self.neo.merge_new_node(node)
+                    self.node_names.add(node)
+                    if metrics is not None:
+                        metrics.count("nodes_created")
+        for node_1, node_2, edge in records:
+            self.neo.queue_edge(node_1, node_2, edge)
+            if metrics is not None:
+                metrics.count("edges_created")
+        return self.graph.flush()
+
+    async def draw_async(self, messages, config: Dict):
+        """ send messages to neo4j server through the asyncio ingestion engine """
+        await ingest_records(config, self.records(messages))
 
     def preprocess_node_names(self, nodes):
         """ extract node names """
         new_nodes = []
         for i, node_name in enumerate(nodes):
-            try:
-                first_char = int(node_name[0])
+            if node_name[:1].isdigit():                             # names can not start with a digit
                 new_nodes.append(f"_{node_name}")
-            except Exception as e:
-                print(f"{e}")
+            else:
                 new_nodes.append(node_name)
 
         return new_nodes
 
 
-def main(log):
-    r = RealTimeDrawer(
-        {
-            "uri": "bolt://localhost:7687",
-            "userName": "neo4j",
-            "password": "test"
-        },
-        LogManager()
+class RealTimeDaemon:
+    """
+    long running realtime service, reads NDJSON messages from stdin, TCP
+    or UDP (syslog) and writes them in micro-batches through one drawer
+    (one driver and connection pool for the whole lifetime)
+    """
 
-    )
-    r.draw(log)
+    def __init__(self, drawer: RealTimeDrawer, batch_size=ENV.Realtime_BATCH_SIZE,
+                 batch_window=ENV.Realtime_BATCH_WINDOW, metrics=None,
+                 max_retries=ENV.Neo4j_MAX_RETRIES, retry_backoff=ENV.Neo4j_RETRY_BACKOFF) -> None:
+        self.drawer = drawer
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        self.drawer.graph.metrics = self.metrics
+        self.drawer.neo.metrics = self.metrics
+        self.batch_size = batch_size            # max messages per batch
+        self.batch_window = batch_window        # max seconds a message waits for its batch
+        self.queue = None
+        self.loop = None
+        self.dropped = 0                        # UDP messages dropped while the queue was full
+        self.max_retries = max_retries          # retries of a batch failing with a transient error
+        self.retry_backoff = retry_backoff      # first retry delay (seconds)
+        self.skipped_batches = 0                # batches which could not be written
+
+    async def run(self, sources):
+        """ start listening on the sources (stdin, tcp:host:port, udp:host:port) and write batches """
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=4 * self.batch_size)
+        servers = []
+        for source in sources:
+            kind, _, address = source.partition(":")
+            if kind == "stdin":
+                Thread(target=self.read_stdin, daemon=True).start()
+            elif kind == "tcp":
+                host, port = address.rsplit(":", 1)
+                servers.append(await asyncio.start_server(self.handle_tcp, host, int(port)))
+            elif kind == "udp":
+                host, port = address.rsplit(":", 1)
+                transport, _ = await self.loop.create_datagram_endpoint(
+                    lambda: SyslogProtocol(self), local_addr=(host, int(port))
+                )
+                servers.append(transport)
+            else:
+                raise Exception(f"Invalid source: {source}")
+        try:
+            await self.write_batches()
+        finally:
+            for server in servers:
+                server.close()
+
+    def read_stdin(self):
+        """ read stdin lines in a thread, waits while the queue is full """
+        for line in sys.stdin:
+            asyncio.run_coroutine_threadsafe(self.put(line), self.loop).result()
+        asyncio.run_coroutine_threadsafe(self.queue.put(STOP), self.loop).result()
+
+    async def handle_tcp(self, reader, writer):
+        """ read NDJSON lines from a TCP client """
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                await self.put(line)
+        finally:
+            writer.close()
+
+    async def put(self, data):
+        """ parse message and add it to the queue """
+        self.metrics.count("lines_read")
+        message = parse_message(data)
+        if message is None:
+            self.drawer.logger.reject(data, "invalid_json")     # log the unprocessible message
+            self.metrics.reject("invalid_json")
+            return
+        await self.queue.put(message)
+
+    def put_nowait(self, data):
+        """ parse message and add it to the queue, drop it if the queue is full """
+        self.metrics.count("lines_read")
+        message = parse_message(data)
+        if message is None:
+            self.drawer.logger.reject(data, "invalid_json")     # log the unprocessible message
+            self.metrics.reject("invalid_json")
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.metrics.reject("queue_full")
+
+    async def write_batches(self):
+        """ collect up to batch_size messages or for batch_window seconds, then write them """
+        stop = False
+        while not stop:
+            message = await self.queue.get()
+            if message is STOP:
+                break
+            batch = [message]
+            deadline = self.loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    message = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if message is STOP:
+                    stop = True
+                    break
+                batch.append(message)
+            records = await self.loop.run_in_executor(None, list, self.drawer.records(batch))
+            with self.metrics.timer("batch_write"):
+                await self.write(records)
+            self.metrics.count("batches")
+            self.metrics.progress()
+        self.metrics.summary()
+
+    async def write(self, records):
+        """write the records of one batch (listeners keep reading meanwhile)
+
+        transient errors (neo4j unavailable, deadlocks) are retried with
+        backoff, a batch which still fails is logged and skipped, so the
+        service keeps running
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self.loop.run_in_executor(None, self.drawer.write_records, records)
+                return
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    error = e
+                    break
+                self.metrics.count("write_retries")
+                delay = self.retry_backoff * 2 ** attempt
+                await asyncio.sleep(delay + random.uniform(0, delay))     # exponential backoff with jitter
+            except Exception as e:
+                error = e
+                break
+        self.skipped_batches += 1
+        self.metrics.count("batches_skipped")
+        print(f"batch of {len(records)} records skipped: {error!r}", file=sys.stderr)
+
+
+class SyslogProtocol(asyncio.DatagramProtocol):
+    """ UDP syslog listener, one message per datagram """
+
+    def __init__(self, daemon: RealTimeDaemon) -> None:
+        self.daemon = daemon
+
+    def datagram_received(self, data, addr):
+        self.daemon.put_nowait(data)
+
+
+def main(log, use_async=False):
+    config = {
+        "uri": "bolt://localhost:7687",
+        "userName": "neo4j",
+        "password": "test"
+    }
+    r = RealTimeDrawer(config, LogManager())
+    message = parse_message(log)
+    if message is None:
+        print("log data is not valid json")
+        exit(2)
+    if use_async:
+        asyncio.run(r.draw_async([message], config))
+    else:
+        r.draw(message)
+
+
+def run_daemon(sources, batch_size, batch_window, dedup=False):
+    """ run the realtime service until the input ends or it is interrupted """
+    config = {
+        "uri": "bolt://localhost:7687",
+        "userName": "neo4j",
+        "password": "test",
+        "batch_size": batch_size,
+    }
+    daemon = RealTimeDaemon(RealTimeDrawer(config, LogManager()), batch_size, batch_window)
+    if dedup:
+        daemon.drawer.graph.deduplicator = Deduplicator()         # forwarded syslog messages may repeat
+    try:
+        asyncio.run(daemon.run(sources))
+    except KeyboardInterrupt:
+        pass
 
 
 if __name__ == "__main__":
-    print(sys.argv)
-    log_data = """{
-        "log": {
-            "host": "4f33df1f5cc2",
-            "host_ip": "172.17.0.2",
-            "program_name": "proxy-server",
-            "client_ip": "172.17.0.1",
-            "remote_addr": "172.17.0.1",
-            "date_time": "2022-04-03 14:01:17.678899",
-            "method": "GET",
-            "path": "/healthcheck",
-            "protocol": "HTTP/1.0",
-            "status_int": 200,
-            "referer": "-",
-            # "user_agent": "curl/7.68.0",
-            "user_agent": "account-server",
-            "auth_token": "-",
-            "bytes_recvd": 0,
-            "bytes_sent": 0,
-            "client_etag": "-",
-            "transaction_id": "txdxxxx",
-            "headers": [
-                "Host: 172.17.0.2:8080",
-                "User-Agent: curl/7.68.0",
-                "Accept: */*",
-                "Content-Type: "
-            ],
-            "request_time": "0.0007",
-            "source": "-",
-            "log_info": "-",
-            "start_time": "164.6",
-            "end_time": "164.7",
-            "policy_index": "-"
-        }
-    }"""
-    main(log_data)
-    if len(sys.argv) > 1:
-        if sys.argv[1] == "--help":
-            print(
-                """
-                draw corresponding graph realtime
-                python3 realtime.py <tokenized log line in JSON format>
-                """
-            )
-        else:
-            log_data = sys.argv[1]
-            main(log_data)
+    arg_parser = argparse.ArgumentParser(
+        description="draw corresponding graph realtime",
+        usage="python3 realtime.py <tokenized log line in JSON format> [--async]\n"
+              "       python3 realtime.py --daemon [--listen stdin|tcp:HOST:PORT|udp:HOST:PORT ...]",
+    )
+    arg_parser.add_argument("log_data", nargs="?", help="tokenized log line in JSON format")
+    arg_parser.add_argument("--async", dest="use_async", action="store_true",
+                            help="write with the asyncio ingestion engine")
+    arg_parser.add_argument("--daemon", action="store_true",
+                            help="keep running and read NDJSON messages from the --listen sources")
+    arg_parser.add_argument("--listen", action="append",
+                            help="stdin, tcp:HOST:PORT or udp:HOST:PORT (syslog), can be repeated")
+    arg_parser.add_argument("--batch-size", type=int, default=ENV.Realtime_BATCH_SIZE,
+                            help="max messages per write")
+    arg_parser.add_argument("--batch-window", type=float, default=ENV.Realtime_BATCH_WINDOW,
+                            help="max seconds a message waits for its batch")
+    arg_parser.add_argument("--dedup", action="store_true",
+                            help="drop repeated messages (bloom filter, see Dedup_* settings)")
+    args = arg_parser.parse_args()
+    if args.daemon:
+        run_daemon(args.listen or ["stdin"], args.batch_size, args.batch_window, args.dedup)
+    elif args.log_data:
+        main(args.log_data, args.use_async)
     else:
         print(
             """
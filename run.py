@@ -1,61 +1,350 @@
-import sys
-import json
+import argparse
+import asyncio
+from os import path as os_path
+from contextlib import ExitStack
 from log_filter import LogFilter
 from neo4j_handler import Neo4jHandler
+from sharded_writer import ShardedNeo4jHandler
+from graph_sink import MemoryGraphSink, NullSink
+from csv_exporter import CsvExportSink
 from graph_handler import GraphHandler
+from async_ingest import ingest_records
+from input_reader import open_input, detect_format, read_txt_lines, read_json_records
+from input_reader import expand_inputs, prefetch, sniff_format
+from input_reader import COMPRESSED_OPENERS
+from checkpoint import Checkpoint, ingest_incremental
+from parse_cache import ParseCache
+from dedup import Deduplicator
+from metrics import PipelineMetrics
 from logs.log_manager import LogManager
+from queries import UNTAGGED_RUN_ID
+from settings import ENV
 
-def main(log_file_name):
+
+def main(args):
     """ main function of the application """
-    logger = LogManager()                                           # initialize logger object                    
+    log_files = expand_inputs(args.log_file_name)                  # files, globs and directories
+    if not log_files:
+        print(f"no log files found: {' '.join(args.log_file_name)}")
+        exit(2)
+    file_formats = []
+    for log_file_name in log_files:
+        file_format = args.format
+        if file_format is None:
+            file_format = detect_format(log_file_name)              # extract input file format from its suffix
+        if file_format is None and os_path.isfile(log_file_name):
+            file_format = sniff_format(log_file_name)               # or from its content
+        if file_format is None:
+            print(f"unknown log format: {log_file_name}, use --format txt|json")
+            exit(2)
+        file_formats.append(file_format)
+    log_file_name, file_format = log_files[0], file_formats[0]
+    merged = len(log_files) > 1                                     # records of all files merged by time
+    workers = args.workers
+
+    logger = LogManager()                                           # initialize logger object
     credentials = {"uri": "bolt://localhost:7687",
-                   "userName": "neo4j", "password": "test"}
+                   "userName": "neo4j", "password": "test",
+                   "batch_size": ENV.Neo4j_BATCH_SIZE,
+                   "concurrency": args.concurrency,
+                   "writers": args.writers,
+                   "run_id": args.run_id}
 
     log_filter = LogFilter()                                        # initialize log filter object
-    neo = Neo4jHandler(credentials)                                 # initialize neo4j handler object
+    if args.export_csv is not None:
+        args.sink = "csv"
+    if args.run_id == UNTAGGED_RUN_ID:
+        print(f"--run-id {UNTAGGED_RUN_ID} is the run_id of untagged nodes")
+        exit(2)
+    if args.sink != "neo4j" and (args.use_async or args.run_id is not None or args.writers > 1):
+        print("--async, --run-id and --writers need the neo4j sink")
+        exit(2)
+    if args.use_async and args.writers > 1:
+        print("--async has its own concurrency (--concurrency), it does not work with --writers")
+        exit(2)
+    if args.mmap and (file_format != "txt" or log_file_name == "-"
+                      or log_file_name.endswith(tuple(COMPRESSED_OPENERS))):
+        print("--mmap needs an uncompressed .txt log file")
+        exit(2)
+    if args.use_async and (args.aggregate or args.transactions or args.traffic_matrix):
+        print("--aggregate, --transactions and --traffic-matrix do not work with --async")
+        exit(2)
+    if args.aggregate and (args.append or args.follow):
+        print("--aggregate does not work with --append/--follow, every checkpointed chunk would write "
+              "its own weighted edges")
+        exit(2)
+    if (args.append or args.follow) and (workers > 1 or args.mmap):
+        print("--append/--follow parse the new lines of each checkpointed chunk in this process, "
+              "without --workers and --mmap")
+        exit(2)
+    if merged and ("-" in log_files or args.mmap or args.parse_cache is not None or args.append or args.follow
+                   or workers > 1):
+        print("several log files are merged in one pass, without stdin, --mmap, --parse-cache, "
+              "--append/--follow and --workers")
+        exit(2)
+    if args.sink == "neo4j" and args.writers > 1:
+        neo = ShardedNeo4jHandler(credentials)                      # edges written by parallel writer threads
+    elif args.sink == "neo4j":
+        neo = Neo4jHandler(credentials)                             # initialize neo4j handler object
+    if args.sink == "memory":
+        neo = MemoryGraphSink()                                     # offline graph, queryable after the run
+    if args.sink == "null":
+        neo = NullSink()                                            # no graph, raw parse throughput
+    if args.sink == "csv":
+        neo = CsvExportSink(args.export_csv)                        # files for neo4j-admin bulk import
 
-    file_extension = log_file_name.split(".")[1]                    # extract input file extension
-    if file_extension == "txt":
-        try:
-            with open(log_file_name) as f:                          # split into lines
-                lines = f.read().split("\n")
-        except FileNotFoundError as e:
-            print(f"{e}")
+    files = []
+    try:
+        for _log_file_name in log_files:
+            files.append(open_input(_log_file_name))
+    except FileNotFoundError as e:
+        print(f"{e}")
+        exit(2)
+    f = files[0]
+
+    total_bytes = None                                              # input size for the progress ETA
+    if "-" not in log_files and not any(name.endswith(tuple(COMPRESSED_OPENERS)) for name in log_files):
+        total_bytes = sum(os_path.getsize(name) for name in log_files)
+    metrics = PipelineMetrics(total_bytes, args.progress_interval, args.metrics_json, args.metrics_prom)
+    traffic_matrix = None
+    if args.traffic_matrix is not None:
+        from traffic_matrix import TrafficMatrix                    # numpy is only needed for the matrix
+        traffic_matrix = TrafficMatrix(args.bucket_seconds)
+    deduplicator = None
+    if args.dedup:
+        deduplicator = Deduplicator(args.dedup_capacity, args.dedup_fp_rate, args.dedup_window)
+    graph_handler = GraphHandler(neo, log_filter, logger, aggregate=args.aggregate, metrics=metrics,
+                                 compact=args.compact, transactions=args.transactions,
+                                 traffic_matrix=traffic_matrix,
+                                 deduplicator=deduplicator)         # initialize graph handler object
+    if args.append or args.follow:
+        f.close()
+        if log_file_name == "-" or log_file_name.endswith(tuple(COMPRESSED_OPENERS)):
+            print("append mode needs an uncompressed log file")
             exit(2)
-    if file_extension == "json":
         try:
-            with open(log_file_name) as f:
-                lines = json.loads(f.read())
-        except FileNotFoundError as e:
-            print(f"{e}")
-            exit(2)
+            failed_batches = ingest_incremental(graph_handler, log_file_name, file_format,
+                                                Checkpoint(args.checkpoint), args.follow)
+        except KeyboardInterrupt:                                   # --follow runs until it is interrupted
+            print("interrupted, the ingested lines are checkpointed")
+            failed_batches = []
+        if failed_batches:
+            exit(1)
+        finish_run(args, neo, logger, metrics, traffic_matrix, deduplicator)
+        return
 
-    graph_handler = GraphHandler(neo, log_filter, logger)           # initialize graph handler object
-    if file_extension == "txt":
-        graph_handler.create_graph_txt(lines)                       # call function for creating graph from .txt file
+    clear = args.run_id is None                                     # a tagged run is built next to the old graph
+    cached = None                                                   # (line, fields) from a valid parse cache
+    if args.parse_cache is not None and file_format == "txt" and log_file_name != "-":
+        parse_cache = ParseCache(args.parse_cache)
+        cached = parse_cache.read(log_file_name)
+        if cached is None:
+            graph_handler.cache_writer = parse_cache.writer(log_file_name)     # cache the lines parsed now
+        else:
+            print(f"using the parsed lines cached in {parse_cache.cache_file(log_file_name)}")
+    with ExitStack() as stack:
+        for _f in files:
+            stack.enter_context(_f)
+        if merged:
+            inputs = [                                              # every file is read ahead by its own thread
+                (metrics.track_lines(prefetch(read_json_records(_f) if _format == "json" else read_txt_lines(_f))),
+                 _format)
+                for _f, _format in zip(files, file_formats)
+            ]
+        elif cached is not None:
+            lines = metrics.track_lines(cached)                     # pre-parsed lines, the log file is not read
+        elif file_format == "txt":
+            lines = metrics.track_lines(read_txt_lines(f))          # stream lines, the file is never fully loaded
+        elif file_format == "json":
+            lines = metrics.track_lines(read_json_records(f))       # stream json records (array or NDJSON)
+
+        if args.use_async:
+            if clear:
+                neo.clear_graph()                                   # clear the database
+            if merged:
+                records = graph_handler.records_merged(inputs)
+            elif cached is not None:
+                records = graph_handler.records_cached(lines)
+            elif args.mmap:
+                records = graph_handler.records_mmap(log_file_name, workers)
+            elif file_format == "txt":
+                records = graph_handler.records_txt(lines, workers)
+            elif file_format == "json":
+                records = graph_handler.records_json(lines)
+            if deduplicator is not None:
+                records = (record for record in records if not graph_handler.is_duplicate(*record))
+            asyncio.run(ingest_records(credentials, records, metrics))    # concurrent writes with the async driver
+        else:
+            if merged:
+                graph_handler.create_graph_merged(inputs, clear=clear)         # k-way merge of the files by time
+            elif cached is not None:
+                graph_handler.create_graph_cached(lines, clear=clear)          # create graph without parsing again
+            elif args.mmap:
+                graph_handler.create_graph_mmap(log_file_name, workers, clear=clear)    # workers parse byte ranges
+            elif file_format == "txt":
+                graph_handler.create_graph_txt(lines, workers, clear=clear)    # call function for creating graph from .txt file
+            elif file_format == "json":
+                graph_handler.create_graph_json(lines, clear=clear)            # call function for creating graph from .json file
 
-    if file_extension == "json":
-        graph_handler.create_graph_json(lines)                      # call function for creating graph from .json file
+    finish_run(args, neo, logger, metrics, traffic_matrix, deduplicator)
 
+
+def finish_run(args, neo, logger, metrics, traffic_matrix, deduplicator):
+    """ end of an ingestion (full or incremental): activate the run, write the side outputs and report """
+    if args.run_id is not None:
+        previous_run_id = neo.activate_run()                        # swap the new graph in
+        print(f"run {args.run_id} is active")
+        if previous_run_id is not None and previous_run_id != args.run_id:
+            print(f"dropping run {previous_run_id} in the background")
+            neo.drop_run_in_background(previous_run_id)
+
+    logger.stop()                                                   # write the queued reject log lines
+    if args.writers > 1:
+        neo.close()                                                 # stop the writer threads
+    if traffic_matrix is not None:
+        with metrics.timer("traffic_matrix_export"):
+            traffic_matrix.export(args.traffic_matrix)
+        print(f"traffic matrix ({len(traffic_matrix.node_names)} nodes, {traffic_matrix.buckets} buckets "
+              f"of {traffic_matrix.bucket_seconds}s) written to {args.traffic_matrix}")
+        if traffic_matrix.skipped:
+            print(f"  {traffic_matrix.skipped} edges without time or outside the time window skipped")
+    if deduplicator is not None:
+        print(f"{deduplicator.duplicates} duplicate lines dropped ({deduplicator.rotations} filter generations retired)")
+    metrics.summary()
+    if args.sink == "memory":
+        print(f"graph: {neo.node_count()} nodes, {neo.edge_count()} edges")
+        if args.transactions:
+            print(f"  {len(neo.transactions)} transactions indexed")
+        for label, count in sorted(neo.label_counts().items()):
+            print(f"  {label}: {count}")
+    if args.sink == "null":
+        print(f"graph: {neo.nodes} nodes, {neo.edges} edges (not stored)")
+    if args.sink == "csv":
+        import_command = neo.close()
+        print(f"exported {len(neo.nodes)} nodes, {neo.edges} edges, import them with:")
+        print(import_command)
     print("finished")
 
 
 if __name__ == "__main__":
-    log_file_name = None
-    if len(sys.argv) > 1:                                           # check if input file name is given    
-        if sys.argv[1] == "--help":                                 # print the manual if --help is given
-            print(
-                """
-                transform logs into Neo4j graphs
-                python3 run.py <log_file_name>
-                """
-            )
-        else:
-            log_file_name = sys.argv[1]                             # extract file name from input
-            main(log_file_name)
-    else:
-        print(
-            """
-            please provide log file name
-            """
-        )
+    arg_parser = argparse.ArgumentParser(
+        description="transform logs into Neo4j graphs",
+        usage="python3 run.py <log_file_name> [<log_file_name> ...]",
+    )
+    arg_parser.add_argument(
+        "log_file_name", nargs="+",
+        help="log files (.txt, .json or NDJSON, optionally .gz/.bz2/.xz), globs or directories, "
+             "'-' reads from stdin; the records of several files are merged in time order",
+    )
+    arg_parser.add_argument(
+        "--format", choices=["txt", "json"], default=None,
+        help="log format, detected from the file suffix or content if not given (required for stdin)",
+    )
+    arg_parser.add_argument(
+        "--workers", type=int, default=1,
+        help="number of parser processes for .txt logs (default 1, no process pool)",
+    )
+    arg_parser.add_argument(
+        "--mmap", action="store_true",
+        help="memory-map the .txt log, with --workers N the workers parse newline aligned "
+             "byte ranges of the file instead of lines sent by this process",
+    )
+    arg_parser.add_argument(
+        "--aggregate", action="store_true",
+        help="write one weighted edge per (source, destination, label) instead of one edge per request",
+    )
+    arg_parser.add_argument(
+        "--parse-cache", nargs="?", const=ENV.Parse_CACHE_DIR, default=None, metavar="DIR",
+        help="cache the parsed .txt lines in DIR (default %(const)s) and reuse them while the "
+             "log file and the parser are unchanged",
+    )
+    arg_parser.add_argument(
+        "--compact", action="store_true",
+        help="keep parsed lines as compact records (shared field names, interned values), "
+             "converted to dicts only when written",
+    )
+    arg_parser.add_argument(
+        "--transactions", action="store_true",
+        help="index the hops of each transaction_id and store them as :Transaction nodes "
+             "(ordered hop lists, start, end and latency)",
+    )
+    arg_parser.add_argument(
+        "--traffic-matrix", default=None, metavar="DIR",
+        help="build a (source x destination x time bucket) matrix of requests, bytes and latency "
+             "and write it to DIR as .npy and CSV (needs numpy)",
+    )
+    arg_parser.add_argument(
+        "--bucket-seconds", type=int, default=ENV.Matrix_BUCKET_SECONDS,
+        help="time bucket of --traffic-matrix in seconds (default one minute)",
+    )
+    arg_parser.add_argument(
+        "--dedup", action="store_true",
+        help="drop repeated lines (overlapping or rotated log files), identified by transaction id, "
+             "time, host and method in a fixed size bloom filter",
+    )
+    arg_parser.add_argument(
+        "--dedup-capacity", type=int, default=ENV.Dedup_CAPACITY,
+        help="lines per --dedup filter generation (two generations are kept in memory)",
+    )
+    arg_parser.add_argument(
+        "--dedup-fp-rate", type=float, default=ENV.Dedup_FP_RATE,
+        help="false positive rate of --dedup, the share of unique lines which may be dropped",
+    )
+    arg_parser.add_argument(
+        "--dedup-window", type=float, default=ENV.Dedup_WINDOW,
+        help="seconds of log time a --dedup generation covers, older lines are forgotten (0 = no expiry)",
+    )
+    arg_parser.add_argument(
+        "--async", dest="use_async", action="store_true",
+        help="write with the asyncio ingestion engine (concurrent transactions, no --aggregate)",
+    )
+    arg_parser.add_argument(
+        "--concurrency", type=int, default=ENV.Neo4j_CONCURRENCY,
+        help="number of concurrent write transactions in --async mode",
+    )
+    arg_parser.add_argument(
+        "--writers", type=int, default=ENV.Neo4j_WRITERS,
+        help="number of writer threads, edges are sharded by node pair (default 1, no sharding); "
+             "deadlocks and other transient errors are retried with backoff",
+    )
+    arg_parser.add_argument(
+        "--append", action="store_true",
+        help="do not clear the graph, only ingest lines after the file checkpoint (.txt or NDJSON)",
+    )
+    arg_parser.add_argument(
+        "--follow", action="store_true",
+        help="like --append, then keep ingesting lines appended to the file (tail -F)",
+    )
+    arg_parser.add_argument(
+        "--checkpoint", default=ENV.Checkpoint_FILE,
+        help="checkpoint file of --append/--follow",
+    )
+    arg_parser.add_argument(
+        "--run-id", default=None,
+        help="tag nodes/edges with this run id instead of clearing the graph, "
+             "activate the run when done and drop the previous one in the background",
+    )
+    arg_parser.add_argument(
+        "--sink", choices=["neo4j", "memory", "null"], default="neo4j",
+        help="where the graph is written: neo4j (default), memory (offline, summary printed) "
+             "or null (measure parsing only)",
+    )
+    arg_parser.add_argument(
+        "--export-csv", default=None, metavar="DIR",
+        help="write nodes/relationships CSV files for `neo4j-admin database import` to DIR "
+             "instead of writing to Neo4j",
+    )
+    arg_parser.add_argument(
+        "--progress-interval", type=float, default=ENV.Metrics_PROGRESS_INTERVAL,
+        help="seconds between progress reports on stderr (0 = only the final summary)",
+    )
+    arg_parser.add_argument(
+        "--metrics-json", default=None, metavar="FILE",
+        help="write a json snapshot of the pipeline metrics to FILE (with every progress report)",
+    )
+    arg_parser.add_argument(
+        "--metrics-prom", default=None, metavar="FILE",
+        help="write the pipeline metrics as a prometheus textfile (node exporter textfile collector)",
+    )
+    args = arg_parser.parse_args()
+    main(args)
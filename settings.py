@@ -14,6 +14,53 @@ class ENV:
     File_ROOT_PATH = str(environ.get("File_ROOT_PATH", "logs"))
     File_MAX_SIZE = int(environ.get("File_MAX_SIZE", 83886080))
     File_BACKUP_COUNT = int(environ.get("File_BACKUP_COUNT", 5))
+    Logger_Background = environ.get("Logger_Background", "1") == "1"    # write log files in a background thread
+    Logger_SAMPLE_THRESHOLD = int(environ.get("Logger_SAMPLE_THRESHOLD", 1000))  # rejected lines/s logged in full
+    Logger_SAMPLE_RATE = int(environ.get("Logger_SAMPLE_RATE", 100))    # above the threshold log 1 of N rejects
+
+    # Parser
+    Parse_MIN_LINES_PER_SEC = int(environ.get("Parse_MIN_LINES_PER_SEC", 0))  # parse throughput guard (0 = off)
+    Parse_CHUNK_SIZE = int(environ.get("Parse_CHUNK_SIZE", 5000))  # lines per parallel parse task
+    Parse_RANGE_SIZE = int(environ.get("Parse_RANGE_SIZE", 4 * 1024 * 1024))  # bytes per memory-mapped parse task
+    Parse_CACHE_DIR = str(environ.get("Parse_CACHE_DIR", ".parse_cache"))  # parsed lines of the ingested files
+    Parse_CACHE_CHUNK_SIZE = int(environ.get("Parse_CACHE_CHUNK_SIZE", 10000))  # lines per compressed cache chunk
+
+    # Neo4j
+    Neo4j_BATCH_SIZE = int(environ.get("Neo4j_BATCH_SIZE", 1000))   # rows per bulk write transaction
+    Neo4j_CONCURRENCY = int(environ.get("Neo4j_CONCURRENCY", 4))      # concurrent async write transactions
+    Neo4j_WRITERS = int(environ.get("Neo4j_WRITERS", 1))              # sharded writer threads (1 = no sharding)
+    Neo4j_QUEUE_SIZE = int(environ.get("Neo4j_QUEUE_SIZE", 8))        # batches waiting for the async writers
+    Neo4j_MAX_RETRIES = int(environ.get("Neo4j_MAX_RETRIES", 5))      # retries of transient write errors
+    Neo4j_RETRY_BACKOFF = float(environ.get("Neo4j_RETRY_BACKOFF", 0.2))  # first retry delay (seconds)
+    Neo4j_DELETE_BATCH_SIZE = int(environ.get("Neo4j_DELETE_BATCH_SIZE", 10000))  # nodes/edges deleted per transaction
+    Neo4j_ENSURE_SCHEMA = environ.get("Neo4j_ENSURE_SCHEMA", "1") == "1"      # create constraints/indexes at startup
+    Neo4j_RELATIONSHIP_INDEXES = environ.get(                                  # indexed properties of every edge label
+        "Neo4j_RELATIONSHIP_INDEXES", "transaction_id,status_int").split(",")
+
+    # Metrics
+    Metrics_PROGRESS_INTERVAL = float(environ.get("Metrics_PROGRESS_INTERVAL", 5))  # seconds between progress reports
+
+    # Traffic matrix
+    Matrix_BUCKET_SECONDS = int(environ.get("Matrix_BUCKET_SECONDS", 60))   # time bucket of the traffic matrix
+    Matrix_BATCH_SIZE = int(environ.get("Matrix_BATCH_SIZE", 10000))      # edges added to the matrix at once
+    Matrix_MAX_BUCKETS = int(environ.get("Matrix_MAX_BUCKETS", 10080))    # buckets kept on either side of the first edge
+
+    # Transactions
+    Transactions_WINDOW = float(environ.get("Transactions_WINDOW", 60))      # seconds of log time a transaction stays open
+    Transactions_MAX_HOPS = int(environ.get("Transactions_MAX_HOPS", 100000))  # hops kept before idle transactions are written
+
+    # Duplicate lines
+    Dedup_CAPACITY = int(environ.get("Dedup_CAPACITY", 10000000))     # lines per bloom filter generation
+    Dedup_FP_RATE = float(environ.get("Dedup_FP_RATE", 0.001))        # false positive rate (unique lines dropped)
+    Dedup_WINDOW = float(environ.get("Dedup_WINDOW", 3600))           # seconds of log time per generation
+
+    # Incremental ingestion
+    Checkpoint_FILE = str(environ.get("Checkpoint_FILE", "checkpoints.json"))     # offsets of ingested files
+    Follow_POLL_INTERVAL = float(environ.get("Follow_POLL_INTERVAL", 1.0))      # seconds between checks of a followed file
+
+    # Realtime
+    Realtime_BATCH_SIZE = int(environ.get("Realtime_BATCH_SIZE", 500))       # max messages per micro-batch
+    Realtime_BATCH_WINDOW = float(environ.get("Realtime_BATCH_WINDOW", 0.2))  # max seconds per micro-batch
 
     mapping = {                         # service name mappings
         "proxy": "P",
@@ -39,6 +86,7 @@ class ENV:
         "172.20.0.8": "m7-r1z1s1",
         "172.20.0.9": "m8-r1z1s1",        
     }
+    proxy_hosts = environ.get("Proxy_HOSTS", "m1-r1z1s1").split(",")     # servers running the proxy (:Proxy nodes)
     method_names = [                   # method names
         "GET", "POST", "PUT", "HEAD", "DELETE", "COPY"
     ]
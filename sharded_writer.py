@@ -0,0 +1,134 @@
+"""
+this file contains the sharded multi-threaded Neo4j writer
+"""
+import random
+from queue import Queue
+from threading import Thread
+from time import perf_counter, sleep
+from typing import Dict, List
+
+from neo4j_handler import RETRYABLE_ERRORS, Neo4jHandler
+from settings import ENV
+
+
+class ShardedNeo4jHandler(Neo4jHandler):
+    """sharded neo4j handler
+
+    edges are partitioned by their (unordered) node pair into one shard
+    per writer thread, every thread writes the batches of its shard in its
+    own sessions; nodes are still created by the calling thread before the
+    edges which need them are handed to the writers
+
+    edges of different pairs still share hub nodes (e.g. the proxy), so
+    transient errors (deadlocks) are retried with exponential backoff
+    """
+
+    def __init__(self, config: Dict) -> None:
+        super(ShardedNeo4jHandler, self).__init__(config)
+        self.writers = int(config.get("writers", ENV.Neo4j_WRITERS))
+        self.max_retries = int(config.get("max_retries", ENV.Neo4j_MAX_RETRIES))
+        self.retry_backoff = float(config.get("retry_backoff", ENV.Neo4j_RETRY_BACKOFF))
+        queue_size = int(config.get("queue_size", ENV.Neo4j_QUEUE_SIZE))
+        self.shard_buffers = [[] for _ in range(self.writers)]     # edges waiting per shard
+        self.queues = [Queue(maxsize=queue_size) for _ in range(self.writers)]
+        self.threads = [
+            Thread(target=self.writer, args=(shard,), name=f"neo4j-writer-{shard}", daemon=True)
+            for shard in range(self.writers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def shard(self, node_1: str, node_2: str) -> int:
+        """ shard of the edges between node_1 and node_2 (in both directions) """
+        pair = (node_1, node_2) if node_1 <= node_2 else (node_2, node_1)
+        return hash(pair) % self.writers
+
+    def queue_edge(self, node_1: str, node_2: str, edge: Dict) -> None:
+        """add edge to the buffer of its shard, hand the buffer to the shard writer when it is full
+
+        :param node_1: source node
+        :param node_2: destination node
+        :param edge: edge properties
+        """
+        shard = self.shard(node_1, node_2)
+        buffer = self.shard_buffers[shard]
+        buffer.append((node_1, node_2, edge))
+        if len(buffer) >= self.batch_size:
+            self.flush_nodes()                                  # the writers only MATCH existing nodes
+            self.send(shard)
+
+    def send(self, shard: int) -> None:
+        """ hand the buffered edges of (shard) to its writer, waits while the writer queue is full """
+        rows, self.shard_buffers[shard] = self.shard_buffers[shard], []
+        if rows and self.relationship_indexes:
+            self.ensure_relationship_indexes({edge["label"] for node_1, node_2, edge in rows})
+        if rows:
+            self.queues[shard].put(rows)
+
+    def flush(self) -> List[Dict]:
+        """write all buffered nodes and edges and wait for the writers
+
+        :return: reports of the batches failed since the last flush
+        """
+        self.flush_nodes()
+        for shard in range(self.writers):
+            self.send(shard)
+        for queue in self.queues:
+            queue.join()
+        with self.lock:
+            failed_batches, self.failed_batches = self.failed_batches, []
+        return failed_batches
+
+    def writer(self, shard: int) -> None:
+        """ write the batches of (shard) until the stop signal """
+        queue = self.queues[shard]
+        while True:
+            rows = queue.get()
+            try:
+                if rows is None:
+                    return
+                self.write_shard_batch(rows)
+            finally:
+                queue.task_done()
+
+    def write_shard_batch(self, rows: List) -> None:
+        """write one batch of edges in one transaction, retry transient errors with backoff
+
+        :param rows: (node_1, node_2, edge) of one shard
+        """
+        with self.lock:
+            self.batch_count += 1
+            batch_number = self.batch_count
+        write = self.edge_writer(rows)
+        for attempt in range(self.max_retries + 1):
+            start = perf_counter()
+            try:
+                with self.graphDB_Driver.session() as graphDB_Session:
+                    graphDB_Session.execute_write(write)
+                if self.metrics is not None:
+                    self.metrics.add_time("neo4j_wait", perf_counter() - start)
+                    self.metrics.add_time("batch_flush_edges", perf_counter() - start)
+                return
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    error = e
+                    break
+                if self.metrics is not None:
+                    self.metrics.count("write_retries")
+                delay = self.retry_backoff * 2 ** attempt
+                sleep(delay + random.uniform(0, delay))         # exponential backoff with jitter
+            except Exception as e:
+                error = e
+                break
+
+        with self.lock:
+            self.failed_batches.append(
+                {"batch": batch_number, "kind": "edges", "size": len(rows), "error": f"{error}"}
+            )
+
+    def close(self) -> None:
+        """ stop the writer threads (after a flush) """
+        for queue in self.queues:
+            queue.put(None)
+        for thread in self.threads:
+            thread.join()
@@ -0,0 +1,49 @@
+"""
+    checks of the asyncio ingestion engine against a recording fake driver
+"""
+import asyncio
+
+from neo4j.exceptions import TransientError
+
+from async_ingest import AsyncIngestor
+from metrics import PipelineMetrics
+
+
+def records(count, nodes=5):
+    """ edges between a few shared nodes (hub nodes of every batch) """
+    return [
+        (f"IP_172_21_0_{i % nodes}", "m1_r1z1s1", {"type": "INFO", "label": "S_GET_P", "transaction_id": f"tx{i}"})
+        for i in range(count)
+    ]
+
+
+def ingest(config, items, metrics=None):
+    ingestor = AsyncIngestor({**config, "concurrency": 4, "retry_backoff": 0}, metrics)
+    return asyncio.run(ingestor.ingest(items))
+
+
+def test_nodes_are_merged_once_before_their_edges(fake_async_driver, neo4j_config):
+    metrics = PipelineMetrics(progress_interval=0)
+    assert ingest(neo4j_config, records(95), metrics) == []
+    merged = [row for _query, parameters in fake_async_driver.matching("MERGE (n:node") for row in parameters["rows"]]
+    assert sorted(merged) == sorted({f"IP_172_21_0_{i}" for i in range(5)} | {"m1_r1z1s1"})
+    edge_queries = fake_async_driver.matching("CREATE (u)")
+    assert all("MERGE" not in query for query, _parameters in edge_queries)
+    assert sum(len(parameters["rows"]) for _query, parameters in edge_queries) == 95
+    first_edge = next(i for i, (query, _parameters) in enumerate(fake_async_driver.queries) if "CREATE (u)" in query)
+    assert all(i < first_edge for i, (query, _parameters) in enumerate(fake_async_driver.queries) if "MERGE" in query)
+    assert metrics.counters["nodes_created"] == 6
+    assert metrics.counters["edges_created"] == 95
+
+
+def test_transient_errors_are_retried(fake_async_driver, neo4j_config):
+    fake_async_driver.failures["CREATE (u)"] = [TransientError("deadlock"), TransientError("deadlock")]
+    assert ingest(neo4j_config, records(30)) == []
+    assert sum(len(parameters["rows"]) for _query, parameters in fake_async_driver.matching("CREATE (u)")) == 30
+
+
+def test_edges_of_unwritten_nodes_are_reported(fake_async_driver, neo4j_config):
+    fake_async_driver.failures["MERGE (n:node"] = [RuntimeError("write failed")]
+    failed_batches = ingest(neo4j_config, records(20))
+    assert [(report["kind"], report["size"]) for report in failed_batches] == [("nodes", 6), ("edges", 10)]
+    assert sum(len(parameters["rows"]) for _query, parameters in fake_async_driver.matching("CREATE (u)")) == 10
@@ -0,0 +1,66 @@
+"""
+    checks of the checkpoints and the incremental ingestion (--append)
+"""
+import os
+
+from checkpoint import Checkpoint, ingest_incremental
+from graph_handler import GraphHandler
+from log_filter import LogFilter
+from log_generator import SwiftLogGenerator
+from neo4j_handler import Neo4jHandler
+
+
+def write_log(path, lines):
+    with open(path, "w") as f:
+        f.writelines(f"{line}\n" for line in lines)
+
+
+def test_resume_offset_round_trip(tmp_path):
+    log_file = tmp_path / "proxy.log"
+    write_log(log_file, ["a", "b"])
+    checkpoint = Checkpoint(str(tmp_path / "checkpoints.json"))
+    assert checkpoint.resume_offset(str(log_file)) == 0
+    checkpoint.save(str(log_file), 2, os.stat(log_file))
+    assert Checkpoint(str(tmp_path / "checkpoints.json")).resume_offset(str(log_file)) == 2
+
+
+def test_rotated_and_truncated_files_start_over(tmp_path):
+    log_file = tmp_path / "proxy.log"
+    write_log(log_file, ["a", "b"])
+    checkpoint = Checkpoint(str(tmp_path / "checkpoints.json"))
+    checkpoint.save(str(log_file), 4, os.stat(log_file))
+    with open(log_file, "w") as f:                              # truncated in place
+        f.write("a\n")
+    assert checkpoint.resume_offset(str(log_file)) == 0
+
+    checkpoint.save(str(log_file), 2, os.stat(log_file))
+    os.rename(log_file, tmp_path / "proxy.log.1")               # rotated
+    write_log(log_file, ["c", "d"])
+    assert checkpoint.resume_offset(str(log_file)) == 0
+
+
+def test_save_keeps_the_identity_of_the_read_file(tmp_path):
+    log_file = tmp_path / "proxy.log"
+    write_log(log_file, ["a", "b"])
+    checkpoint = Checkpoint(str(tmp_path / "checkpoints.json"))
+    with open(log_file, "rb") as f:
+        stat = os.fstat(f.fileno())
+        f.read()
+        os.rename(log_file, tmp_path / "proxy.log.1")           # rotated between the read and the save
+        write_log(log_file, ["c", "d", "e"])
+        checkpoint.save(str(log_file), 4, stat)
+    assert checkpoint.resume_offset(str(log_file)) == 0         # the new file is read from its start
+
+
+def test_failed_writes_do_not_advance_the_checkpoint(tmp_path, fake_driver, neo4j_config, null_logger):
+    log_file = tmp_path / "proxy.log"
+    write_log(log_file, SwiftLogGenerator(seed=1).lines(200))
+    checkpoint = Checkpoint(str(tmp_path / "checkpoints.json"))
+    graph_handler = GraphHandler(Neo4jHandler(neo4j_config), LogFilter(), null_logger)
+
+    fake_driver.failures["CREATE (u)"] = [RuntimeError("write failed")]     # an automatic flush fails
+    assert ingest_incremental(graph_handler, str(log_file), "txt", checkpoint)
+    assert checkpoint.resume_offset(str(log_file)) == 0
+
+    assert ingest_incremental(graph_handler, str(log_file), "txt", checkpoint) == []
+    assert checkpoint.resume_offset(str(log_file)) == os.path.getsize(log_file)
@@ -0,0 +1,100 @@
+"""
+    end-to-end checks of GraphHandler on synthetic logs (MemoryGraphSink, no neo4j)
+"""
+from collections import Counter
+
+import pytest
+
+from benchmark import NullLogger
+from dedup import Deduplicator
+from edge_aggregator import edge_timestamp
+from graph_handler import GraphHandler
+from graph_sink import MemoryGraphSink
+from log_filter import LogFilter
+from log_generator import SwiftLogGenerator
+
+LINE_COUNT = 3000
+SEED = 7
+
+
+@pytest.fixture(scope="module")
+def lines():
+    return list(SwiftLogGenerator(seed=SEED).lines(LINE_COUNT))
+
+
+@pytest.fixture(scope="module")
+def records():
+    return list(SwiftLogGenerator(seed=SEED).records(LINE_COUNT))
+
+
+def build(log, log_format="txt", workers=1, **options):
+    """ graph of (log) in a new MemoryGraphSink """
+    sink = MemoryGraphSink()
+    graph_handler = GraphHandler(sink, LogFilter(), NullLogger(), **options)
+    if log_format == "txt":
+        graph_handler.create_graph_txt(log, workers, chunk_size=500)
+    else:
+        graph_handler.create_graph_json(log)
+    return sink
+
+
+def edge_list(sink):
+    """ (node_1, node_2, label, properties) of all edges in creation order """
+    return list(sink.edges())
+
+
+def edge_counts(sink):
+    """ number of edges per (node_1, node_2, label) """
+    return Counter((node_1, node_2, label) for node_1, node_2, label, _properties in sink.edges())
+
+
+def test_txt_graph(lines):
+    sink = build(lines)
+    assert sink.node_count() > 0
+    assert 0 < sink.edge_count() < LINE_COUNT           # malformed, stderr and updater lines are rejected
+
+
+def test_json_graph_matches_txt(lines, records):
+    txt, json = build(lines), build(records, "json")
+    assert txt.get_node_names() == json.get_node_names()
+    assert not edge_counts(txt) - edge_counts(json)     # json records also keep the updater requests
+
+
+def test_json_edges_keep_time(records):
+    assert all(edge_timestamp(properties) is not None for *_nodes, properties in edge_list(build(records, "json")))
+
+
+@pytest.mark.parametrize("log_format", ["txt", "json"])
+def test_compact_matches_plain(lines, records, log_format):
+    log = lines if log_format == "txt" else records
+    assert edge_list(build(log, log_format, compact=True)) == edge_list(build(log, log_format))
+
+
+def test_workers_match_single_process(lines):
+    assert edge_list(build(lines, workers=2)) == edge_list(build(lines))
+
+
+@pytest.mark.parametrize("log_format", ["txt", "json"])
+def test_aggregate_counts_raw_edges(lines, records, log_format):
+    log = lines if log_format == "txt" else records
+    raw = edge_counts(build(log, log_format))
+    aggregated = build(log, log_format, aggregate=True)
+    assert aggregated.edge_count() == len(raw)
+    assert {
+        (node_1, node_2, label): properties["count"]
+        for node_1, node_2, label, properties in aggregated.edges()
+    } == dict(raw)
+
+
+@pytest.mark.parametrize("log_format", ["txt", "json"])
+def test_dedup_drops_repeated_lines(lines, records, log_format):
+    log = lines if log_format == "txt" else records
+    deduplicator = Deduplicator(capacity=10 * LINE_COUNT)
+    once = build(log, log_format)
+    twice = build(log + log, log_format, deduplicator=deduplicator)
+    assert edge_list(twice) == edge_list(once)
+    assert deduplicator.duplicates == once.edge_count()
+
+
+def test_dedup_keeps_unique_lines(lines):
+    assert edge_list(build(lines, deduplicator=Deduplicator(capacity=10 * LINE_COUNT))) == edge_list(build(lines))
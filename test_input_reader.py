@@ -0,0 +1,37 @@
+"""
+    checks of the streaming json reader
+"""
+import io
+import json
+
+import pytest
+
+from input_reader import read_json_records
+
+RECORDS = [{"remote_addr": f"172.20.0.{i}", "request": "GET /v1/AUTH_test HTTP/1.1", "index": i} for i in range(50)]
+
+
+def ndjson(records):
+    return "".join(json.dumps(record) + "\n" for record in records)
+
+
+@pytest.mark.parametrize("chunk_size", [7, 64, 65536])
+def test_ndjson_is_streamed(chunk_size):
+    assert list(read_json_records(io.StringIO(ndjson(RECORDS)), chunk_size)) == RECORDS
+
+
+@pytest.mark.parametrize("chunk_size", [7, 65536])
+def test_json_array_is_streamed(chunk_size):
+    assert list(read_json_records(io.StringIO(json.dumps(RECORDS, indent=2)), chunk_size)) == RECORDS
+
+
+@pytest.mark.parametrize("chunk_size", [7, 65536])
+def test_malformed_lines_are_rejected(chunk_size):
+    text = ndjson(RECORDS[:10]) + '{"remote_addr": oops}\n' + ndjson(RECORDS[10:]) + '{"remote_addr": "172.20'
+    records = list(read_json_records(io.StringIO(text), chunk_size))
+    assert records == RECORDS[:10] + ['{"remote_addr": oops}'] + RECORDS[10:] + ['{"remote_addr": "172.20']
+
+
+def test_long_record_is_read():
+    record = {"request": "x" * 100000}
+    assert list(read_json_records(io.StringIO(ndjson([record, record])), 16)) == [record, record]
@@ -0,0 +1,54 @@
+"""
+    checks of the bulk writer of Neo4jHandler against a recording fake driver
+"""
+from neo4j_handler import Neo4jHandler
+
+
+def edge(label="P_GET_O", **properties):
+    return {"type": "INFO", "label": label, **properties}
+
+
+def test_bulk_writes_batches(fake_driver, neo4j_config):
+    neo = Neo4jHandler(neo4j_config)
+    for i in range(25):
+        neo.queue_node(f"node_{i}")
+    for i in range(24):
+        neo.queue_edge(f"node_{i}", f"node_{i + 1}", edge())
+    assert neo.flush() == []
+    created = [row for _query, parameters in fake_driver.matching("CREATE (u)") for row in parameters["rows"]]
+    assert len(created) == 24
+    assert all(len(parameters["rows"]) <= neo4j_config["batch_size"]
+               for _query, parameters in fake_driver.matching("UNWIND"))
+
+
+def test_auto_flush_failures_reach_the_final_flush(fake_driver, neo4j_config):
+    neo = Neo4jHandler(neo4j_config)
+    fake_driver.failures["CREATE (u)"] = [RuntimeError("write failed")]     # first edge batch only
+    neo.queue_node("a")
+    neo.queue_node("b")
+    for _ in range(25):
+        neo.queue_edge("a", "b", edge())
+    failed_batches = neo.flush()
+    assert [(report["kind"], report["size"]) for report in failed_batches] == [("edges", 10)]
+    assert neo.flush() == []                                                # handed over once
+
+
+def test_schema_has_one_node_key(fake_driver, neo4j_config):
+    Neo4jHandler({**neo4j_config, "ensure_schema": True})
+    statements = [query for query, _parameters in fake_driver.queries]
+    assert "DROP CONSTRAINT node_name IF EXISTS" in statements
+    assert [query for query in statements if query.startswith("CREATE CONSTRAINT")] == [
+        "CREATE CONSTRAINT node_name_run_id IF NOT EXISTS FOR (n:node) REQUIRE (n.name, n.run_id) IS UNIQUE"
+    ]
+
+
+def test_untagged_nodes_have_a_run_id(fake_driver, neo4j_config):
+    neo = Neo4jHandler(neo4j_config)
+    neo.queue_node("m1_r1z1s1")
+    neo.queue_node("IP_172_20_0_1")
+    neo.queue_edge("IP_172_20_0_1", "m1_r1z1s1", edge())
+    neo.flush()
+    node_queries = fake_driver.matching("CREATE (:node")
+    edge_queries = fake_driver.matching("CREATE (u)")
+    assert node_queries and edge_queries
+    assert all("run_id: '-'" in query for query, _parameters in node_queries + edge_queries)
@@ -0,0 +1,179 @@
+"""
+    this file contains the time bucketed traffic matrix between the graph nodes
+"""
+import csv
+from array import array
+from os import makedirs as os_makedirs
+from os import path as os_path
+
+import numpy as np
+
+from edge_aggregator import edge_timestamp, format_timestamp, to_number
+from settings import ENV
+
+
+class TrafficMatrix:
+    """
+    dense (source node x destination node x time bucket) arrays of request
+    counts, bytes and latency sums, built next to GraphHandler
+
+    edges are buffered as plain number arrays and added to the matrices in
+    batches with np.add.at, the matrices grow (doubling) when new nodes or
+    time buckets show up; only edges less than (max_buckets) buckets before
+    or after the first edge are added, so a wrong timestamp can not blow up
+    the time axis
+    """
+
+    def __init__(self, bucket_seconds=ENV.Matrix_BUCKET_SECONDS, batch_size=ENV.Matrix_BATCH_SIZE,
+                 max_buckets=ENV.Matrix_MAX_BUCKETS) -> None:
+        self.bucket_seconds = bucket_seconds
+        self.batch_size = batch_size
+        self.max_buckets = max_buckets
+        self.anchor_bucket = None           # absolute bucket number of the first edge
+        self.node_ids = {}                  # node name -> matrix row/column
+        self.node_names = []
+        self.first_bucket = None            # absolute bucket number of bucket index 0
+        self.buckets = 0                    # used time buckets
+        self.skipped = 0                    # edges without time or outside the time window
+        self.counts = np.zeros((0, 0, 0), dtype=np.int64)
+        self.bytes = np.zeros((0, 0, 0), dtype=np.float64)
+        self.latency_sum = np.zeros((0, 0, 0), dtype=np.float64)
+        self.latency_count = np.zeros((0, 0, 0), dtype=np.int64)
+        self.reset_buffer()
+
+    def reset_buffer(self) -> None:
+        """ start an empty batch """
+        self.sources = array("q")
+        self.destinations = array("q")
+        self.bucket_numbers = array("q")    # absolute bucket numbers (unix time // bucket_seconds)
+        self.edge_bytes = array("d")
+        self.latencies = array("d")         # NaN if the request time is unknown
+
+    def node_id(self, node) -> int:
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            node_id = self.node_ids[node] = len(self.node_names)
+            self.node_names.append(node)
+        return node_id
+
+    def add(self, node_1, node_2, edge) -> None:
+        """ add one edge (request) to the batch """
+        timestamp = edge_timestamp(edge)
+        if timestamp is None:
+            self.skipped += 1
+            return
+        bucket_number = int(timestamp // self.bucket_seconds)
+        if self.anchor_bucket is None:
+            self.anchor_bucket = bucket_number
+        elif abs(bucket_number - self.anchor_bucket) >= self.max_buckets:
+            self.skipped += 1
+            return
+        bytes_sent = to_number(edge.get("bytes_sent"))
+        bytes_recvd = to_number(edge.get("bytes_recvd"))
+        if bytes_sent is None and bytes_recvd is None:
+            size = to_number(edge.get("content_length")) or 0.0           # object/container/account servers
+        else:
+            size = (bytes_sent or 0.0) + (bytes_recvd or 0.0)
+        latency = to_number(edge.get("request_time"))
+
+        self.sources.append(self.node_id(node_1))
+        self.destinations.append(self.node_id(node_2))
+        self.bucket_numbers.append(bucket_number)
+        self.edge_bytes.append(size)
+        self.latencies.append(np.nan if latency is None else latency)
+        if len(self.sources) >= self.batch_size:
+            self.apply()
+
+    def apply(self) -> None:
+        """ add the buffered edges to the matrices (vectorized) """
+        if not len(self.sources):
+            return
+        sources = np.frombuffer(self.sources, dtype=np.int64)
+        destinations = np.frombuffer(self.destinations, dtype=np.int64)
+        bucket_numbers = np.frombuffer(self.bucket_numbers, dtype=np.int64)
+        edge_bytes = np.frombuffer(self.edge_bytes, dtype=np.float64)
+        latencies = np.frombuffer(self.latencies, dtype=np.float64)
+
+        self.grow(int(bucket_numbers.min()), int(bucket_numbers.max()))
+        buckets = bucket_numbers - self.first_bucket
+        cells = (sources, destinations, buckets)
+        np.add.at(self.counts, cells, 1)
+        np.add.at(self.bytes, cells, edge_bytes)
+        known = ~np.isnan(latencies)
+        known_cells = (sources[known], destinations[known], buckets[known])
+        np.add.at(self.latency_sum, known_cells, latencies[known])
+        np.add.at(self.latency_count, known_cells, 1)
+        self.reset_buffer()
+
+    def grow(self, min_bucket, max_bucket) -> None:
+        """ make room for all nodes and for the buckets min_bucket..max_bucket """
+        if self.first_bucket is None:
+            self.first_bucket = min_bucket
+        before = max(0, self.first_bucket - min_bucket)              # older buckets than the first one
+        self.first_bucket -= before
+        self.buckets = max(self.buckets + before, max_bucket - self.first_bucket + 1)
+
+        nodes = len(self.node_names)
+        node_capacity, _, bucket_capacity = self.counts.shape
+        if nodes <= node_capacity and self.buckets <= bucket_capacity and not before:
+            return
+        new_nodes = max(nodes, 2 * node_capacity) if nodes > node_capacity else node_capacity
+        new_buckets = (
+            max(self.buckets, 2 * bucket_capacity) if self.buckets > bucket_capacity else bucket_capacity
+        )
+        padding = ((0, new_nodes - node_capacity), (0, new_nodes - node_capacity),
+                   (before, max(0, new_buckets - bucket_capacity - before)))
+        self.counts = np.pad(self.counts, padding)
+        self.bytes = np.pad(self.bytes, padding)
+        self.latency_sum = np.pad(self.latency_sum, padding)
+        self.latency_count = np.pad(self.latency_count, padding)
+
+    def matrices(self):
+        """
+        :return: (counts, bytes, latency sums, latency counts) trimmed to the used nodes and buckets
+        """
+        self.apply()
+        nodes = len(self.node_names)
+        return tuple(
+            matrix[:nodes, :nodes, :self.buckets]
+            for matrix in (self.counts, self.bytes, self.latency_sum, self.latency_count)
+        )
+
+    def bucket_start(self, bucket) -> float:
+        """ unix time of the start of bucket index (bucket) """
+        return (self.first_bucket + bucket) * self.bucket_seconds
+
+    def export(self, output_dir) -> None:
+        """
+        write counts.npy, bytes.npy, latency_sum.npy, latency_count.npy
+        (source x destination x bucket), nodes.txt (row/column names),
+        buckets.txt (bucket start times) and traffic.csv (one row per non empty cell)
+        """
+        counts, sizes, latency_sum, latency_count = self.matrices()
+        os_makedirs(output_dir, exist_ok=True)
+        np.save(os_path.join(output_dir, "counts.npy"), counts)
+        np.save(os_path.join(output_dir, "bytes.npy"), sizes)
+        np.save(os_path.join(output_dir, "latency_sum.npy"), latency_sum)
+        np.save(os_path.join(output_dir, "latency_count.npy"), latency_count)
+        with open(os_path.join(output_dir, "nodes.txt"), "w") as f:
+            f.writelines(f"{node}\n" for node in self.node_names)
+        with open(os_path.join(output_dir, "buckets.txt"), "w") as f:
+            f.writelines(f"{format_timestamp(self.bucket_start(bucket))}\n" for bucket in range(self.buckets))
+
+        with open(os_path.join(output_dir, "traffic.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["bucket_start", "source", "destination", "requests", "bytes", "latency_sum",
+                             "latency_mean"])
+            buckets, sources, destinations = np.nonzero(counts.transpose(2, 0, 1))     # rows in time order
+            for bucket, source, destination in zip(buckets.tolist(), sources.tolist(), destinations.tolist()):
+                known = latency_count[source, destination, bucket]
+                latency = latency_sum[source, destination, bucket]
+                writer.writerow([
+                    format_timestamp(self.bucket_start(bucket)),
+                    self.node_names[source],
+                    self.node_names[destination],
+                    int(counts[source, destination, bucket]),
+                    float(sizes[source, destination, bucket]),
+                    float(latency),
+                    float(latency / known) if known else "-",
+                ])
@@ -0,0 +1,167 @@
+"""
+    this file contains the index of the hops of each swift transaction
+"""
+from collections import OrderedDict
+
+from edge_aggregator import edge_timestamp, to_number
+from settings import ENV
+
+MISSING_NUMBER = -1.0                   # missing times in the hop lists (neo4j lists can not hold nulls)
+
+
+class Hop:
+    """
+    one request of a transaction (one log line)
+    """
+
+    __slots__ = ("source", "destination", "label", "timestamp", "request_time", "status")
+
+    def __init__(self, source, destination, label, timestamp, request_time, status) -> None:
+        self.source = source
+        self.destination = destination
+        self.label = label
+        self.timestamp = timestamp          # unix time of the request (None if unknown)
+        self.request_time = request_time    # seconds (None if unknown)
+        self.status = status
+
+    def end(self):
+        """ unix time the request was answered """
+        if self.timestamp is None:
+            return None
+        return self.timestamp + (self.request_time or 0.0)
+
+
+class TransactionIndex:
+    """
+    hops of each transaction_id, collected during the ingestion
+
+    a proxy request and the object/container/account requests it fans out
+    to share the transaction id; the hops of a transaction are ordered by
+    their time and summarized with the end-to-end latency
+
+    transactions without a hop for (window) seconds of log time are closed
+    by drain_idle, which is due every (max_hops) added hops, so only the
+    open transactions are kept in memory; a transaction closed too early
+    is summarized again later and merged by the sink (write_transactions)
+    """
+
+    def __init__(self, window=ENV.Transactions_WINDOW, max_hops=ENV.Transactions_MAX_HOPS) -> None:
+        self.window = window                # seconds of log time without a hop until a transaction is closed
+        self.max_hops = max_hops            # hops added between two drain_idle calls (and kept after one)
+        self.transactions = OrderedDict()   # transaction id -> [Hop, ...], least recently extended first
+        self.last_seen = {}                 # transaction id -> log time of its latest hop
+        self.latest = None                  # latest log time of all hops
+        self.hops = 0                       # hops in the index
+        self.added = 0                      # hops added since the last drain_idle
+
+    def __len__(self) -> int:
+        return len(self.transactions)
+
+    def add(self, node_1, node_2, edge) -> None:
+        """ add the edge (log line) to the hops of its transaction """
+        transaction_id = edge.get("transaction_id")
+        if not transaction_id or transaction_id == "-":
+            return
+        hop = Hop(
+            node_1, node_2, edge["label"], edge_timestamp(edge),
+            to_number(edge.get("request_time")), edge.get("status_int", "-"),
+        )
+        hops = self.transactions.get(transaction_id)
+        if hops is None:
+            self.transactions[transaction_id] = [hop]
+        else:
+            hops.append(hop)
+            self.transactions.move_to_end(transaction_id)
+        if hop.timestamp is not None:
+            self.last_seen[transaction_id] = hop.timestamp
+            if self.latest is None or hop.timestamp > self.latest:
+                self.latest = hop.timestamp
+        self.hops += 1
+        self.added += 1
+
+    def due(self) -> bool:
+        """ True if drain_idle should be called (every max_hops added hops) """
+        return self.added >= self.max_hops
+
+    def chain(self, transaction_id):
+        """ hops of (transaction_id) in time order, hops without time last """
+        return ordered(self.transactions.get(transaction_id, []))
+
+    def summary(self, transaction_id):
+        """ summary of (transaction_id), see summarize """
+        return summarize(transaction_id, self.transactions.get(transaction_id, []))
+
+    def drain(self):
+        """
+        yield the summaries of all transactions and start over
+        """
+        transactions, self.transactions = self.transactions, OrderedDict()
+        self.last_seen, self.latest, self.hops, self.added = {}, None, 0, 0
+        for transaction_id, hops in transactions.items():
+            yield summarize(transaction_id, hops)
+
+    def drain_idle(self):
+        """
+        :return: summaries of the idle transactions (no hop for window
+                 seconds), and of the least recently extended ones while
+                 more than max_hops hops are kept
+        """
+        self.added = 0
+        cutoff = None if self.latest is None else self.latest - self.window
+        summaries = []
+        while self.transactions:
+            transaction_id, hops = next(iter(self.transactions.items()))
+            last_seen = self.last_seen.get(transaction_id)
+            idle = last_seen is None or (cutoff is not None and last_seen < cutoff)
+            if not idle and self.hops <= self.max_hops:
+                break
+            del self.transactions[transaction_id]
+            self.last_seen.pop(transaction_id, None)
+            self.hops -= len(hops)
+            summaries.append(summarize(transaction_id, hops))
+        return summaries
+
+
+def ordered(hops):
+    """ hops in time order, hops without time last """
+    return sorted(hops, key=lambda hop: (hop.timestamp is None, hop.timestamp or 0.0))
+
+
+def summarize(transaction_id, hops):
+    """
+    :return: dict of the ordered hop lists, start, end and latency of a transaction
+    """
+    hops = ordered(hops)
+    starts = [hop.timestamp for hop in hops if hop.timestamp is not None]
+    ends = [hop.end() for hop in hops if hop.timestamp is not None]
+    start = min(starts) if starts else None
+    end = max(ends) if ends else None
+    return {
+        "transaction_id": transaction_id,
+        "hop_sources": [hop.source for hop in hops],
+        "hop_destinations": [hop.destination for hop in hops],
+        "hop_labels": [hop.label for hop in hops],
+        "hop_times": [MISSING_NUMBER if hop.timestamp is None else hop.timestamp for hop in hops],
+        "hop_request_times": [MISSING_NUMBER if hop.request_time is None else hop.request_time for hop in hops],
+        "hop_status": [str(hop.status) for hop in hops],
+        "hop_count": len(hops),
+        "start": start,
+        "end": end,
+        "latency": end - start if starts else None,
+    }
+
+
+def merge_summaries(old, new):
+    """
+    combine two summaries of the same transaction (written in different flushes)
+    """
+    merged = dict(old)
+    for key in ("hop_sources", "hop_destinations", "hop_labels", "hop_times", "hop_request_times", "hop_status"):
+        merged[key] = old[key] + new[key]
+    merged["hop_count"] = old["hop_count"] + new["hop_count"]
+    starts = [start for start in (old["start"], new["start"]) if start is not None]
+    ends = [end for end in (old["end"], new["end"]) if end is not None]
+    merged["start"] = min(starts) if starts else None
+    merged["end"] = max(ends) if ends else None
+    merged["latency"] = merged["end"] - merged["start"] if starts else None
+    return merged